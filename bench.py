@@ -0,0 +1,170 @@
+# Benchmarks for Porter's algorithm and the corpus pipeline
+# Every step of the algorithm, measure() and vowel(), stem() and the whole
+# pipeline from reading a corpus to counting its stems are timed on the
+# culture corpus and on synthetic corpora of growing size whose word
+# frequencies follow Zipf's law. For each benchmark, the number of words per
+# second and the peak memory allocated while it runs are reported as JSON.
+# Given the JSON of an earlier run as a baseline, the benchmarks fail when
+# the throughput of any of them drops by more than a threshold.
+#
+# Usage: python bench.py [--output results.json] [--baseline baseline.json]
+#                        [--threshold 0.2] [--sizes 10000 100000] [--repeat 3]
+
+import porter
+import porter_corpus
+import argparse
+import io
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+# Build a synthetic corpus of size words drawn from a vocabulary of
+# vocabulary_size made-up words, the word of rank r being drawn with a
+# probability proportional to 1 / r. Most made-up words end with a suffix
+# of some rule so that all of the steps have work to do.
+def zipf_corpus(size, vocabulary_size=None, seed=2017):
+	generator = random.Random(seed)
+	if vocabulary_size is None:
+		vocabulary_size = max(size // 10, 1)
+	suffixes = [rule[0] for rule in porter.step2_rules + porter.step3_rules + porter.step4_rules]
+	suffixes += ['s', 'es', 'ies', 'sses', 'ed', 'ing', 'eed', 'y', 'e', 'll', '', '', '']
+	vocabulary = []
+	for i in range(vocabulary_size):
+		stem_length = generator.randint(2, 7)
+		word = ''.join(generator.choice('bcdfghlmnprstvaeiouy') for j in range(stem_length))
+		vocabulary.append(word + generator.choice(suffixes))
+	weights = [1 / rank for rank in range(1, vocabulary_size + 1)]
+	return ' '.join(generator.choices(vocabulary, weights, k=size))
+
+def read_corpus(path='corpus-culture'):
+	f = open(path, 'r')
+	text = f.read()
+	f.close()
+	return text
+
+# Run function on argument repeat times and return the shortest time taken
+# along with the peak memory allocated by one more run of it
+def measure_run(function, argument, repeat):
+	times = []
+	for i in range(repeat):
+		start = time.perf_counter()
+		function(argument)
+		times.append(time.perf_counter() - start)
+	tracemalloc.start()
+	tracemalloc.reset_peak()
+	baseline = tracemalloc.get_traced_memory()[0]
+	function(argument)
+	peak = tracemalloc.get_traced_memory()[1] - baseline
+	tracemalloc.stop()
+	return min(times), peak
+
+def result(words, seconds, peak):
+	return {'words': words, 'seconds': seconds,
+		'words_per_second': words / seconds if seconds > 0 else float('inf'),
+		'peak_allocated_bytes': peak}
+
+# Benchmark every step on the words of text, each step being given the words
+# as the steps before it leave them, then measure() and vowel() on the
+# results, then stem() and stem_batch() on the words themselves
+def benchmark_steps(text, repeat):
+	results = {}
+	words = list(porter_corpus.tokens([text]))
+	inputs = words
+	for step in [porter.step1a, porter.step1b, porter.step1c, porter.step2,
+	porter.step3, porter.step4, porter.step5a, porter.step5b]:
+		(seconds, peak) = measure_run(lambda inputs: list(map(step, inputs)), inputs, repeat)
+		results[step.__name__] = result(len(inputs), seconds, peak)
+		inputs = list(map(step, inputs))
+	(seconds, peak) = measure_run(lambda inputs: list(map(porter.measure, inputs)), inputs, repeat)
+	results['measure'] = result(len(inputs), seconds, peak)
+	positions = [(word, i) for word in words for i in range(len(word))]
+	(seconds, peak) = measure_run(lambda inputs: [porter.vowel(word, i) for (word, i) in inputs],
+		positions, repeat)
+	results['vowel'] = result(len(positions), seconds, peak)
+	(seconds, peak) = measure_run(lambda inputs: list(map(porter.stem, inputs)), words, repeat)
+	results['stem'] = result(len(words), seconds, peak)
+	if porter.numpy is not None:
+		(seconds, peak) = measure_run(porter.stem_batch, words, repeat)
+		results['stem_batch'] = result(len(words), seconds, peak)
+	return results
+
+# Benchmark the pipeline of stem.py on text, from breaking it into words to
+# counting the words and their stems
+def benchmark_pipeline(text, repeat):
+	words = sum(1 for word in porter_corpus.tokens([text]))
+	(seconds, peak) = measure_run(lambda text: porter_corpus.count(porter_corpus.tokens(porter_corpus.read_chunks(io.StringIO(text)))),
+		text, repeat)
+	return result(words, seconds, peak)
+
+def run(sizes, repeat):
+	benchmarks = {}
+	text = read_corpus()
+	for (name, value) in benchmark_steps(text, repeat).items():
+		benchmarks['culture/' + name] = value
+	benchmarks['culture/pipeline'] = benchmark_pipeline(text, repeat)
+	for size in sizes:
+		text = zipf_corpus(size)
+		for (name, value) in benchmark_steps(text, repeat).items():
+			benchmarks['zipf-%d/%s' % (size, name)] = value
+		benchmarks['zipf-%d/pipeline' % size] = benchmark_pipeline(text, repeat)
+	return {'python': platform.python_version(), 'machine': platform.machine(),
+		'benchmarks': benchmarks}
+
+# Return the names of the benchmarks whose throughput dropped by more than
+# threshold, as a fraction, from that in baseline
+def regressions(results, baseline, threshold):
+	names = []
+	for (name, value) in results['benchmarks'].items():
+		if name in baseline['benchmarks']:
+			before = baseline['benchmarks'][name]['words_per_second']
+			if value['words_per_second'] < before * (1 - threshold):
+				names.append(name)
+	return names
+
+def regressions_test():
+	baseline = {'benchmarks': {'a': {'words_per_second': 100.0}, 'b': {'words_per_second': 100.0}}}
+	results = {'benchmarks': {'a': {'words_per_second': 85.0}, 'b': {'words_per_second': 75.0},
+		'c': {'words_per_second': 1.0}}}
+	if regressions(results, baseline, 0.2) == ['b']:
+		print("regressions_test() passed")
+	else:
+		print("regressions_test() failed")
+
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description='Benchmark Porter\'s algorithm and the corpus pipeline.')
+	parser.add_argument('--output', help='file to write the results to as JSON (default: standard output)')
+	parser.add_argument('--baseline', help='JSON results of an earlier run to compare against')
+	parser.add_argument('--threshold', type=float, default=0.2,
+		help='largest drop in throughput from the baseline allowed, as a fraction (default: 0.2)')
+	parser.add_argument('--sizes', type=int, nargs='*', default=[10000, 100000, 1000000],
+		help='numbers of words of the synthetic corpora')
+	parser.add_argument('--repeat', type=int, default=3, help='number of timed runs of each benchmark')
+	options = parser.parse_args(arguments)
+
+	results = run(options.sizes, options.repeat)
+	output = json.dumps(results, indent=2, sort_keys=True)
+	if options.output:
+		f = open(options.output, 'w')
+		f.write(output + '\n')
+		f.close()
+	else:
+		print(output)
+
+	if options.baseline:
+		f = open(options.baseline, 'r')
+		baseline = json.load(f)
+		f.close()
+		names = regressions(results, baseline, options.threshold)
+		for name in names:
+			print('Throughput of %s dropped from %.0f to %.0f words per second' % (name,
+				baseline['benchmarks'][name]['words_per_second'],
+				results['benchmarks'][name]['words_per_second']), file=sys.stderr)
+		if names:
+			return 1
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
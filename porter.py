@@ -3,6 +3,16 @@
 # Author: Kwabena Antwi-Boasiako
 # June 2017
 
+from collections import OrderedDict
+import re
+import time
+
+# NumPy is only needed by stem_batch()
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
 # Step 1a
 # SSES -> SS                         caresses  ->  caress
 # IES  -> I                          ponies    ->  poni
@@ -12,14 +22,22 @@
 def step1a(string):
 	if string[-4:] == 'sses':
 		result = string[:-4] + 'ss'
+		suffix = 'sses'
 	elif string[-3:] == 'ies':
 		result = string[:-3] + 'i'
+		suffix = 'ies'
 	elif string[-2:] == 'ss':
 		result = string
+		suffix = 'ss'
 	elif string[-1:] == 's':
 		result = string[:-1]
+		suffix = 's'
 	else:
 		result = string
+		suffix = None
+
+	if instrumentation is not None and suffix is not None:
+		instrumentation.count('step1a', suffix, True)
 
 	return result
 
@@ -69,43 +87,42 @@ def step1a_test():
 # *o  - the stem ends cvc, where the second c is not W, X or Y (e.g.
        # -WIL, -HOP).
 def step1b(string):
-	rule2_or_rule3_successful = False
-	if string[-3:] == 'eed': 
-		if measure(string[:-3]) > 0:
-			result = string[:-3] + 'ee'
-		else:
-			result = string
-	elif string[-2:] == 'ed':
-		if True in list(map(lambda i: vowel(string[:-2], i), range(len(string[:-2])))):
-			result = string[:-2]
-			rule2_or_rule3_successful = True
-		else:
-			result = string
-	elif string[-3:] == 'ing':
-		if True in list(map(lambda i: vowel(string[:-3], i), range(len(string[:-3])))):
-			result = string[:-3]
-			rule2_or_rule3_successful = True
-		else:
-			result = string
+	length = len(string)
+	if string[-3:] == 'eed':
+		pattern = CVPattern(string)
+		fired = pattern.measure(length - 3) > 0
+		if fired:
+			pattern.replace(length - 1, '')
+		if instrumentation is not None:
+			instrumentation.count('step1b', 'eed', fired)
+	elif string[-2:] == 'ed' or string[-3:] == 'ing':
+		pattern = CVPattern(string)
+		suffix = 'ed' if string[-2:] == 'ed' else 'ing'
+		end = length - len(suffix)
+		fired = pattern.has_vowel(end)
+		if instrumentation is not None:
+			instrumentation.count('step1b', suffix, fired)
+		if fired:
+			result = pattern.replace(end, '')
+			rule = None
+			if result[-2:] in ('at', 'bl', 'iz'):
+				pattern.replace(end, 'e')
+				rule = result[-2:]
+			elif pattern.ends_double(end) and result[-1] not in 'lsz':
+				pattern.replace(end - 1, '')
+				rule = '*d'
+			# A stem of two letters also counts as ending cvc here, since the
+			# check for it reads the positions before the stem from its end
+			elif pattern.measure(end) == 1 and \
+			(pattern.ends_cvc(end) or (end == 2 and result[-1] not in 'wxy')):
+				pattern.replace(end, 'e')
+				rule = '*o'
+			if instrumentation is not None and rule is not None:
+				instrumentation.count('step1b', rule, True)
 	else:
-		result = string
-		
-	if rule2_or_rule3_successful:
-		if result[-2:] == 'at':
-			result = result[:-2] + 'ate'
-		elif result[-2:] == 'bl':
-			result = result[:-2] + 'ble'
-		elif result[-2:] == 'iz':
-			result = result[:-2] + 'ize'
-		elif not vowel(result, len(result) - 1) and result[-1] == result[-2] and result[-1] not in 'lsz':
-			result = result[:-1]
-		elif measure(result) == 1 and not vowel(result, len(result) - 3) and \
-		vowel(result, len(result) - 2) and not vowel(result, len(result) - 1) and result[-1] not in 'wxy':
-			result += 'e'
-		else:
-			pass
+		return string
 
-	return result
+	return pattern.string
 
 # Basic test for step1b()
 def step1b_test():
@@ -131,10 +148,13 @@ def step1b_test():
 # Step 1 deals with plurals and past participles. The subsequent steps are
 # much more straightforward.
 def step1c(string):
-	if string[-1:] == 'y' and any(list(map(lambda i: vowel(string[:-1], i), range(len(string[:-1]))))):
+	if string[-1:] == 'y' and CVPattern(string).has_vowel(len(string) - 1):
 		result = string[:-1] + 'i'
 	else:
 		result = string
+
+	if instrumentation is not None and string[-1:] == 'y':
+		instrumentation.count('step1c', 'y', result != string)
 		
 	return result
 
@@ -151,6 +171,146 @@ def step1c_test():
 		print(expected_outputs)
 		print(outputs)
 
+# Steps 2, 3 and 4 are given as tables of rules, each a suffix, its
+# replacement and the condition on the stem under which the suffix is
+# replaced, written as in the paper: m>N, m=N or m<N for the measure of the
+# stem, *v*, *d and *o, and *S, *T and so on for the letter that ends the
+# stem, joined with and, or, not and parentheses. A step tries its suffixes
+# in the order of its table. A rule whose suffix matches but whose condition
+# fails lets the later rules be tried, except for a rule whose suffix is one
+# of the stops of the step, such as ATIONAL in step 2. Only rules whose
+# suffixes end one another can both match a word, so only IZATION -> ATION
+# and EMENT -> MENT -> ENT ever fall through in practice.
+#
+# compile_step() turns a table into the source of a function of the step. The
+# suffixes of the table are put in a trie, read from their ends, which the
+# function follows as nested tests of the letters of the word from its last
+# one, so that a word costs a test of at most one letter per level however
+# many rules the step has. Where a suffix ends, the rules it matches are
+# tried with their conditions inlined. A word for which they all fail is
+# left as it is, while one that does not go on to a longer suffix goes back
+# to the longest suffix it matched. The function takes the CVPattern of the
+# word as an optional second argument, so that stem() can run the steps on
+# the pattern it keeps, and only computes one itself once a suffix matches.
+
+condition_pattern = re.compile(r'\s*(?:m\s*([<>=])\s*(\d+)|(\*v\*)|\*([do])\b|\*([A-Z])\b|(and|or|not|\(|\)))')
+
+# Translate condition into a Python expression of the stem ending at position
+# end, with terms giving the translation of each kind of term
+def compile_condition(condition, terms):
+	expression = []
+	position = 0
+	condition = condition.rstrip()
+	while position < len(condition):
+		match = condition_pattern.match(condition, position)
+		if match is None:
+			raise ValueError('cannot read condition %r at %r' % (condition, condition[position:]))
+		(operator, number, v, d_or_o, letter, word) = match.groups()
+		if operator is not None:
+			expression.append(terms['m'] % ({'=': '=='}.get(operator, operator), int(number)))
+		elif v is not None:
+			expression.append(terms['*v*'])
+		elif d_or_o is not None:
+			expression.append(terms['*' + d_or_o])
+		elif letter is not None:
+			expression.append(terms['*L'] % {'letter': letter.lower(), 'code': ord(letter.lower())})
+		else:
+			expression.append(terms[word])
+		position = match.end()
+	return ' '.join(expression)
+
+condition_terms = {'m': 'measures[end] %s %d', '*v*': '0 <= pattern.first_vowel < end',
+	'*d': 'pattern.ends_double(end)', '*o': 'pattern.ends_cvc(end)',
+	'*L': "(end > 0 and string[end - 1] == '%(letter)s')", 'and': 'and', 'or': 'or',
+	'not': 'not', '(': '(', ')': ')'}
+
+# For every suffix of rules, the rules that a word ending with that suffix
+# matches, in the order in which they are to be tried
+def rule_candidates(rules, stops=()):
+	candidates = {}
+	for (suffix, replacement, condition) in rules:
+		candidates[suffix] = []
+		for rule in rules:
+			if suffix.endswith(rule[0]):
+				candidates[suffix].append(rule)
+				if rule[0] in stops:
+					break
+	return candidates
+
+# Return the source of the function of the step called name with the given
+# rules
+def step_source(name, rules, stops=()):
+	candidates = rule_candidates(rules, stops)
+	trie = OrderedDict()
+	for (suffix, replacement, condition) in rules:
+		node = trie
+		for c in reversed(suffix):
+			node = node.setdefault(c, OrderedDict())
+		node[''] = suffix
+	lines = ['def %s(string, pattern=None):' % name, '\tlength = len(string)']
+
+	# Add the tests of the words that end with the depth letters leading to
+	# node
+	def add_node(node, depth, indent):
+		letters = [c for c in node if c]
+		if letters:
+			lines.append(indent + 'if length > %d:' % depth)
+			lines.append(indent + '\tc%d = string[length - %d]' % (depth + 1, depth + 1))
+			for (i, c) in enumerate(letters):
+				lines.append(indent + '\t%s c%d == %r:' % ('if' if i == 0 else 'elif', depth + 1, c))
+				add_node(node[c], depth + 1, indent + '\t\t')
+		if '' in node:
+			lines.extend([indent + 'if pattern is None:',
+				indent + '\tpattern = CVPattern(string)',
+				indent + 'measures = pattern.measures'])
+			for (rule, replacement, condition) in candidates[node['']]:
+				lines.extend([indent + 'end = length - %d' % len(rule),
+					indent + 'fired = %s' % compile_condition(condition, condition_terms),
+					indent + 'if instrumentation is not None:',
+					indent + '\tinstrumentation.count(%r, %r, fired)' % (name, rule),
+					indent + 'if fired:',
+					indent + '\treturn pattern.replace(end, %r)' % replacement])
+			lines.append(indent + 'return string')
+
+	add_node(trie, 0, '\t')
+	lines.append('\treturn string')
+	return '\n'.join(lines) + '\n'
+
+# Compile the rules of a step into its function
+def compile_step(name, rules, stops=()):
+	source = step_source(name, rules, stops)
+	namespace = {}
+	exec(compile(source, '<%s rules>' % name, 'exec'), globals(), namespace)
+	function = namespace[name]
+	function.source = source
+	return function
+
+def rule_candidates_test():
+	pairs = [('ational', ('ational',)), ('tional', ('tional',)),
+	('ization', ('ization', 'ation')), ('ement', ('ement', 'ment', 'ent')),
+	('tion', ('tion',)), ('al', ('al',))]
+	inputs = [a for (a, b) in pairs]
+	expected_outputs = [b for (a, b) in pairs]
+	candidates = rule_candidates(step2_rules, step2_stops)
+	candidates.update(rule_candidates(step4_rules))
+	outputs = [tuple(rule[0] for rule in candidates[suffix]) for suffix in inputs]
+	try:
+		compile_condition('m>1 and *Q*', condition_terms)
+		failed_to_raise = True
+	except ValueError:
+		failed_to_raise = False
+	conditions = [compile_condition(condition, condition_terms) for condition in
+		['m>0', 'm=1 and not *o', '*v* or (*d and *L)']]
+	expected_conditions = ['measures[end] > 0', 'measures[end] == 1 and not pattern.ends_cvc(end)',
+		"0 <= pattern.first_vowel < end or ( pattern.ends_double(end) and (end > 0 and string[end - 1] == 'l') )"]
+	if expected_outputs == outputs and expected_conditions == conditions and not failed_to_raise:
+		print("rule_candidates_test() passed")
+	else:
+		print("rule_candidates_test() failed")
+		print(expected_outputs)
+		print(outputs)
+		print(conditions)
+
 # Step 2
 # (m>0) ATIONAL ->  ATE           relational     ->  relate
 # (m>0) TIONAL  ->  TION          conditional    ->  condition
@@ -173,54 +333,15 @@ def step1c_test():
 # (m>0) ALITI   ->  AL            formaliti      ->  formal
 # (m>0) IVITI   ->  IVE           sensitiviti    ->  sensitive
 # (m>0) BILITI  ->  BLE           sensibiliti    ->  sensible
-def step2(string):
-	if string[-7:] == 'ational':
-		if measure(string[:-7]) > 0:
-			result = string[:-7] + 'ate'
-		else:
-			result = string
-	elif string[-6:] == 'tional' and measure(string[:-6]) > 0:
-		result = string[:-6] + 'tion'
-	elif string[-4:] == 'enci' and measure(string[:-4]) > 0:
-		result = string[:-4] + 'ence'
-	elif string[-4:] == 'anci' and measure(string[:-4]) > 0:
-		result = string[:-4] + 'ance'
-	elif string[-4:] == 'izer' and measure(string[:-4]) > 0:
-		result = string[:-4] + 'ize'
-	elif string[-4:] == 'abli' and measure(string[:-4]) > 0:
-		result = string[:-4] + 'able'
-	elif string[-4:] == 'alli' and measure(string[:-4]) > 0:
-		result = string[:-4] + 'al'
-	elif string[-5:] == 'entli' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'ent'
-	elif string[-3:] == 'eli' and measure(string[:-3]) > 0:
-		result = string[:-3] + 'e'
-	elif string[-5:] == 'ousli' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'ous'
-	elif string[-7:] == 'ization' and measure(string[:-7]) > 0:
-		result = string[:-7] + 'ize'
-	elif string[-5:] == 'ation' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'ate'
-	elif string[-4:] == 'ator' and measure(string[:-4]) > 0:
-		result = string[:-4] + 'ate'
-	elif string[-5:] == 'alism' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'al'
-	elif string[-7:] == 'iveness' and measure(string[:-7]) > 0:
-		result = string[:-7] + 'ive'
-	elif string[-7:] == 'fulness' and measure(string[:-7]) > 0:
-		result = string[:-7] + 'ful'
-	elif string[-7:] == 'ousness' and measure(string[:-7]) > 0:
-		result = string[:-7] + 'ous'
-	elif string[-5:] == 'aliti' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'al'
-	elif string[-5:] == 'iviti' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'ive'
-	elif string[-6:] == 'biliti' and measure(string[:-6]) > 0:
-		result = string[:-6] + 'ble'
-	else:
-		result = string
-
-	return result
+step2_rules = (('ational', 'ate', 'm>0'), ('tional', 'tion', 'm>0'),
+	('enci', 'ence', 'm>0'), ('anci', 'ance', 'm>0'), ('izer', 'ize', 'm>0'),
+	('abli', 'able', 'm>0'), ('alli', 'al', 'm>0'), ('entli', 'ent', 'm>0'),
+	('eli', 'e', 'm>0'), ('ousli', 'ous', 'm>0'), ('ization', 'ize', 'm>0'),
+	('ation', 'ate', 'm>0'), ('ator', 'ate', 'm>0'), ('alism', 'al', 'm>0'),
+	('iveness', 'ive', 'm>0'), ('fulness', 'ful', 'm>0'), ('ousness', 'ous', 'm>0'),
+	('aliti', 'al', 'm>0'), ('iviti', 'ive', 'm>0'), ('biliti', 'ble', 'm>0'))
+step2_stops = ('ational',)
+step2 = compile_step('step2', step2_rules, step2_stops)
 
 # Basic test for step2()
 def step2_test():
@@ -251,25 +372,9 @@ def step2_test():
 # (m>0) ICAL  ->  IC              electrical     ->  electric
 # (m>0) FUL   ->                  hopeful        ->  hope
 # (m>0) NESS  ->                  goodness       ->  good
-def step3(string):
-	if string[-5:] == 'icate' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'ic'
-	elif string[-5:] == 'ative' and measure(string[:-5]) > 0:
-		result = string[:-5]
-	elif string[-5:] == 'alize' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'al'
-	elif string[-5:] == 'iciti' and measure(string[:-5]) > 0:
-		result = string[:-5] + 'ic'
-	elif string[-4:] == 'ical' and measure(string[:-4]) > 0:
-		result = string[:-4] + 'ic'
-	elif string[-3:] == 'ful' and measure(string[:-3]) > 0:
-		result = string[:-3]
-	elif string[-4:] == 'ness' and measure(string[:-4]) > 0:
-		result = string[:-4]
-	else:
-		result = string
-	
-	return result
+step3_rules = (('icate', 'ic', 'm>0'), ('ative', '', 'm>0'), ('alize', 'al', 'm>0'),
+	('iciti', 'ic', 'm>0'), ('ical', 'ic', 'm>0'), ('ful', '', 'm>0'), ('ness', '', 'm>0'))
+step3 = compile_step('step3', step3_rules)
 
 # Basic test for step3()
 def step3_test():
@@ -306,49 +411,16 @@ def step3_test():
 # (m>1) OUS   ->                  homologous     ->  homolog
 # (m>1) IVE   ->                  effective      ->  effect
 # (m>1) IZE   ->                  bowdlerize     ->  bowdler
-def step4(string):
-	if string[-2:] == 'al' and measure(string[:-2]) > 1:
-		result = string[:-2]
-	elif string[-4:] == 'ance' and measure(string[:-4]) > 1:
-		result = string[:-4]
-	elif string[-4:] == 'ence' and measure(string[:-4]) > 1:
-		result = string[:-4]
-	elif string[-2:] == 'er' and measure(string[:-2]) > 1:
-		result = string[:-2]
-	elif string[-2:] == 'ic' and measure(string[:-2]) > 1:
-		result = string[:-2]
-	elif string[-4:] == 'able' and measure(string[:-4]) > 1:
-		result = string[:-4]
-	elif string[-4:] == 'ible' and measure(string[:-4]) > 1:
-		result = string[:-4]
-	elif string[-3:] == 'ant' and measure(string[:-3]) > 1:
-		result = string[:-3]
-	elif string[-5:] == 'ement' and measure(string[:-5]) > 1:
-		result = string[:-5]
-	elif string[-4:] == 'ment' and measure(string[:-4]) > 1:
-		result = string[:-4]
-	elif string[-3:] == 'ent' and measure(string[:-3]) > 1:
-		result = string[:-3]
-	elif string[-3:] == 'ion' and string[-4] in 'st' and measure(string[:-4]) > 1:
-		result = string[:-3]
-	elif string[-2:] == 'ou' and measure(string[:-2]) > 1:
-		result = string[:-2]
-	elif string[-3:] == 'ism' and measure(string[:-3]) > 1:
-		result = string[:-3]
-	elif string[-3:] == 'ate' and measure(string[:-3]) > 1:
-		result = string[:-3]
-	elif string[-3:] == 'iti' and measure(string[:-3]) > 1:
-		result = string[:-3]
-	elif string[-3:] == 'ous' and measure(string[:-3]) > 1:
-		result = string[:-3]
-	elif string[-3:] == 'ive' and measure(string[:-3]) > 1:
-		result = string[:-3]
-	elif string[-3:] == 'ize' and measure(string[:-3]) > 1:
-		result = string[:-3]
-	else:
-		result = string
-		
-	return result
+#
+# The stem of ION is measured without the S or T that ends it, so ION is
+# given as SION -> S and TION -> T, which measure the same stem.
+step4_rules = (('al', '', 'm>1'), ('ance', '', 'm>1'), ('ence', '', 'm>1'),
+	('er', '', 'm>1'), ('ic', '', 'm>1'), ('able', '', 'm>1'), ('ible', '', 'm>1'),
+	('ant', '', 'm>1'), ('ement', '', 'm>1'), ('ment', '', 'm>1'), ('ent', '', 'm>1'),
+	('sion', 's', 'm>1'), ('tion', 't', 'm>1'), ('ou', '', 'm>1'), ('ism', '', 'm>1'),
+	('ate', '', 'm>1'), ('iti', '', 'm>1'), ('ous', '', 'm>1'), ('ive', '', 'm>1'),
+	('ize', '', 'm>1'))
+step4 = compile_step('step4', step4_rules)
 
 # Basic test for step4()
 def step4_test():
@@ -375,12 +447,14 @@ def step4_test():
 # (m=1 and not *o) E ->           cease          ->  ceas
 def step5a(string):
 	length = len(string)
-	if string[-1:] == 'e' and measure(string[:-1]) > 1:
-		result = string[:-1]
-	elif length >= 4 and string[-1:] == 'e' and measure(string[:-1]) == 1 and not (not vowel(string[:-1], len(string[:-1]) - 3) and	vowel(string[:-1], len(string[:-1]) - 2) and not vowel(string[:-1], len(string[:-1]) - 1) and string[-2:-1] not in 'wxy'):
-		result = string[:-1]
-	else:
-		result = string
+	result = string
+	if string[-1:] == 'e':
+		pattern = CVPattern(string)
+		m = pattern.measure(length - 1)
+		if m > 1 or (length >= 4 and m == 1 and not pattern.ends_cvc(length - 1)):
+			result = string[:-1]
+		if instrumentation is not None:
+			instrumentation.count('step5a', 'e', result != string)
 
 	return result
 
@@ -403,11 +477,14 @@ def step5a_test():
 #                                 controll       ->  control
 #                                 roll           ->  roll
 def step5b(string):
-	if measure(string) > 1 and string[-2:] == 'll':
+	if string[-2:] == 'll' and measure(string) > 1:
 		result = string[:-1]
 	else:
 		result = string
 
+	if instrumentation is not None and string[-2:] == 'll':
+		instrumentation.count('step5b', 'll', result != string)
+
 	return result
 
 def step5b_test():
@@ -454,26 +531,27 @@ def step5b_test():
 # m=0    TR,  EE,  TREE,  Y,  BY.
 # m=1    TROUBLE,  OATS,  TREES,  IVY.
 # m=2    TROUBLES,  PRIVATE,  OATEN,  ORRERY.
+#
+# measure() reads the string from left to right, keeping track of whether it
+# is reading the consonants that open the string (state 0), vowels (state 1)
+# or the consonants that follow them (state 2), and counts a VC pair whenever
+# it goes from vowels to consonants. Once a VC pair is complete, the rest of
+# the string is read as if it were a string of its own, so a Y that opens it
+# is a consonant, nothing preceding it there.
 def measure(string):
-	i = 0
-	length = len(string)
-	# Read as many consonants as possible
-	while i < length and not vowel(string, i):
-		i += 1
-	# We either hit the first vowel or the entire string is composed of consonants or the string is empty
-	if i == length:
-		return 0
-	else:
-		# Read as many vowels as possible
-		while i < length and vowel(string, i):
-			i += 1
-		if i == length:
-			return 0
-		else:
-			# Read as many consonants as possible
-			while i < length and not vowel(string, i):
-				i += 1
-			return 1 + measure(string[i:])
+	m = 0
+	state = 0
+	for i in range(len(string)):
+		c = string[i]
+		if c in 'aeiou' or (c == 'y' and i > 0 and string[i - 1] not in 'aeiou'):
+			if state == 2:
+				state = 0 if c == 'y' else 1
+			else:
+				state = 1
+		elif state == 1:
+			state = 2
+			m += 1
+	return m
 
 def measure_test():
 	pairs = [('tr', 0), ('ee', 0), ('tree', 0), ('y', 0), ('by', 0), 
@@ -511,10 +589,699 @@ def vowel_test():
 	else:
 		print("vowel_test() failed")
 
+# The consonant/vowel pattern of a word, computed once so that the conditions
+# of the rules can be checked on any prefix of the word in constant time,
+# without slicing the word. For every position i, cv[i] == vowel(string, i)
+# and states[i] is the state measure() is in after reading position i, while
+# measures[k] is the measure of the first k characters. As in measure(), a Y
+# that follows a complete VC pair is read as a consonant in states and
+# measures, but not in cv. replace() keeps all of it up to date when the end of
+# the word is replaced, only reading the new characters.
+class CVPattern:
+	def __init__(self, string):
+		self.string = ''
+		self.cv = []
+		self.states = []
+		self.measures = [0]
+		self.first_vowel = -1
+		self.replace(0, string)
+
+	# m of the first length characters
+	def measure(self, length):
+		return self.measures[length]
+
+	# *v* - the first length characters contain a vowel
+	def has_vowel(self, length):
+		return 0 <= self.first_vowel < length
+
+	# *d - the first length characters end with a double consonant
+	def ends_double(self, length):
+		return length >= 2 and not self.cv[length - 1] and \
+			self.string[length - 1] == self.string[length - 2]
+
+	# *o - the first length characters end cvc, where the second c is not W, X
+	# or Y
+	def ends_cvc(self, length):
+		cv = self.cv
+		return length >= 3 and not cv[length - 3] and cv[length - 2] and \
+			not cv[length - 1] and self.string[length - 1] not in 'wxy'
+
+	# Replace everything from position end onwards with replacement and return
+	# the new string
+	def replace(self, end, replacement):
+		cv = self.cv
+		states = self.states
+		measures = self.measures
+		del cv[end:]
+		del states[end:]
+		del measures[end + 1:]
+		if self.first_vowel >= end:
+			self.first_vowel = -1
+		string = self.string[:end] + replacement
+		self.string = string
+		state = states[-1] if end > 0 else 0
+		m = measures[-1]
+		for i in range(end, len(string)):
+			c = string[i]
+			is_vowel = c in 'aeiou' or (c == 'y' and i > 0 and string[i - 1] not in 'aeiou')
+			if is_vowel:
+				if self.first_vowel < 0:
+					self.first_vowel = i
+				if state == 2:
+					state = 0 if c == 'y' else 1
+				else:
+					state = 1
+			elif state == 1:
+				state = 2
+				m += 1
+			cv.append(is_vowel)
+			states.append(state)
+			measures.append(m)
+		return string
+
+def cv_pattern_test():
+	pattern = CVPattern('troubles')
+	outputs = [pattern.measure(8), pattern.measure(7), pattern.measure(2),
+		pattern.has_vowel(2), pattern.has_vowel(3), pattern.ends_double(8)]
+	pattern.replace(3, 'p')
+	outputs += [pattern.string, pattern.ends_cvc(4), pattern.measure(4)]
+	pattern.replace(4, 'p')
+	outputs += [pattern.string, pattern.ends_double(5), pattern.ends_cvc(5)]
+	# The last Y of ACRYLY is read as a consonant by measure()
+	pattern = CVPattern('acryly')
+	outputs += [pattern.measure(6), pattern.cv[5]]
+	expected_outputs = [2, 1, 0, False, True, False, 'trop', True, 1, 'tropp', True, False, 1, True]
+	if expected_outputs == outputs:
+		print("cv_pattern_test() passed")
+	else:
+		print("cv_pattern_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# Opt-in instrumentation of the algorithm. While it is enabled, stem() runs
+# the words through step1a() up to step5b() in turn, timing every step, and
+# the steps count how often each of their rules matched a word, how often it
+# fired and how often its condition failed. The rules are named after their
+# suffixes, while *d and *o name the rules that follow a successful ED or ING
+# in step 1b. When instrumentation is disabled, which it is by default, all
+# this costs a test of a global variable per word and per matched rule.
+class Instrumentation:
+	def __init__(self):
+		self.steps = {}
+
+	def step(self, name):
+		if name not in self.steps:
+			self.steps[name] = {'calls': 0, 'seconds': 0.0, 'rules': {}}
+		return self.steps[name]
+
+	# Record that rule of step matched a word and fired or not
+	def count(self, step, rule, fired):
+		rules = self.step(step)['rules']
+		if rule not in rules:
+			rules[rule] = {'matched': 0, 'fired': 0, 'failed': 0}
+		counts = rules[rule]
+		counts['matched'] += 1
+		if fired:
+			counts['fired'] += 1
+		else:
+			counts['failed'] += 1
+
+	# Record that step ran once, taking seconds
+	def time(self, step, seconds):
+		entry = self.step(step)
+		entry['calls'] += 1
+		entry['seconds'] += seconds
+
+	# Return a copy of what has been recorded so far
+	def snapshot(self):
+		return {name: {'calls': entry['calls'], 'seconds': entry['seconds'],
+			'rules': {rule: dict(counts) for (rule, counts) in entry['rules'].items()}}
+			for (name, entry) in self.steps.items()}
+
+	def reset(self):
+		self.steps = {}
+
+instrumentation = None
+
+# Start recording and return the Instrumentation that records
+def enable_instrumentation():
+	global instrumentation
+	instrumentation = Instrumentation()
+	return instrumentation
+
+# Stop recording and return what was recorded
+def disable_instrumentation():
+	global instrumentation
+	snapshot = instrumentation.snapshot() if instrumentation is not None else {}
+	instrumentation = None
+	return snapshot
+
+# Stem word one step at a time, timing every step
+def instrumented_stem(word):
+	for step in [step1a, step1b, step1c, step2, step3, step4, step5a, step5b]:
+		start = time.perf_counter()
+		word = step(word)
+		instrumentation.time(step.__name__, time.perf_counter() - start)
+	return word
+
+def instrumentation_test():
+	enable_instrumentation()
+	outputs = list(map(stem, ['hopping', 'rational', 'relational', 'caresses', 'sky']))
+	snapshot = disable_instrumentation()
+	expected_outputs = ['hop', 'ration', 'relat', 'caress', 'sky']
+	if expected_outputs == outputs and instrumentation is None and \
+	snapshot['step1a']['calls'] == 5 and \
+	snapshot['step1a']['rules'] == {'sses': {'matched': 1, 'fired': 1, 'failed': 0}} and \
+	snapshot['step1b']['rules']['*d'] == {'matched': 1, 'fired': 1, 'failed': 0} and \
+	snapshot['step2']['rules']['ational'] == {'matched': 2, 'fired': 1, 'failed': 1} and \
+	'tional' not in snapshot['step2']['rules'] and \
+	snapshot['step4']['rules']['al'] == {'matched': 1, 'fired': 1, 'failed': 0}:
+		print("instrumentation_test() passed")
+	else:
+		print("instrumentation_test() failed")
+		print(expected_outputs)
+		print(outputs)
+		print(snapshot)
+
+# Every rule of every step needs a word to end with its suffix, and a step
+# that changes nothing leaves the word for the next one as it was, so a word
+# that no rule can change as it is comes out of the algorithm as it went in.
+# A rule can only change a word long enough for the condition on its stem:
+# m>N takes N + 1 pairs of a vowel and a consonant, so 2N + 2 letters, and
+# step 5a needs four letters in all. Every rule but those of step 1a also
+# needs a vowel before its suffix, for which a Y is counted as one.
+#
+# rule_minimums holds every rule as its suffix, the length of the shortest
+# word it can change and whether it needs a vowel. trigger_suffixes leaves
+# out the suffixes ending with another of them, and trigger_minimums holds
+# for each of those the shortest word and the need of a vowel of all of the
+# rules whose suffixes end with it. Checking a word against them lets stem()
+# skip the steps for the commonest words, such as THE, AND, OF, BY and HER.
+rule_minimums = [('sses', 4, False), ('ies', 3, False), ('s', 1, False),
+	('eed', 5, True), ('ed', 3, True), ('ing', 4, True), ('y', 2, True),
+	('e', 4, True), ('ll', 4, True)] + \
+	[(suffix, len(suffix) + 2 * int(condition[len('m>'):]) + 2, True)
+		for (suffix, replacement, condition) in step2_rules + step3_rules + step4_rules]
+
+# Return the trigger suffixes of rules, given as in rule_minimums, and their
+# minimums
+def triggers(rules):
+	suffixes = tuple(sorted(suffix for (suffix, length, needs_vowel) in rules
+		if not any(suffix != other and suffix.endswith(other) for (other, _, _) in rules)))
+	minimums = {}
+	for (suffix, length, needs_vowel) in rules:
+		trigger = [other for other in suffixes if suffix.endswith(other)][0]
+		(shortest, all_need_vowel) = minimums.get(trigger, (length, needs_vowel))
+		minimums[trigger] = (min(shortest, length), all_need_vowel and needs_vowel)
+	return (suffixes, minimums)
+
+(trigger_suffixes, trigger_minimums) = triggers(rule_minimums)
+trigger_lengths = tuple(sorted({len(suffix) for suffix in trigger_suffixes}))
+vowel_pattern = re.compile('[aeiouy]')
+
+# Return false if the algorithm cannot change word. A word ends with at most
+# one of the trigger suffixes.
+def can_change(word):
+	for n in trigger_lengths:
+		minimums = trigger_minimums.get(word[-n:])
+		if minimums is not None:
+			return len(word) >= minimums[0] and \
+				(not minimums[1] or vowel_pattern.search(word, 0, len(word) - n) is not None)
+	return False
+
+# Words whose stems are given rather than worked out by the algorithm, such as
+# names that it would mangle. stem() and stem_batch() look words up here
+# first. A StemCache keeps the stems it has already given, so it should be
+# cleared when this table changes.
+exceptions = {}
+
+# Add the words of table, a dict, with the stems they are to be given
+def add_exceptions(table):
+	exceptions.update(table)
+
+# Leave the given words as they are
+def protect(words):
+	exceptions.update((word, word) for word in words)
+
+def clear_exceptions():
+	exceptions.clear()
+
+def can_change_test():
+	words = ['the', 'and', 'of', 'star', 'a', 'sky', 'cats', 'rational', 'hopping', 'feed',
+	'roll', 'rate', 'adoption', 'bowdlerize', 'x', '', 'by', 'he', 'she', 'are', 'her', 's', 'ay']
+	expected_outputs = [False, False, False, False, False, False, True, True, True, True,
+	True, True, True, True, False, False, False, False, False, False, False, True, True]
+	outputs = list(map(can_change, words))
+	# Words that cannot change go through the steps unchanged
+	unchanged = []
+	for word in words:
+		result = word
+		for step in [step1a, step1b, step1c, step2, step3, step4, step5a, step5b]:
+			result = step(result)
+		unchanged.append(can_change(word) or result == word)
+	add_exceptions({'news': 'news', 'universities': 'university'})
+	protect(['fisher', 'cats'])
+	exception_outputs = list(map(stem, ['news', 'universities', 'fisher', 'cats', 'dogs']))
+	clear_exceptions()
+	exception_outputs.append(stem('cats'))
+	if expected_outputs == outputs and all(unchanged) and \
+	exception_outputs == ['news', 'university', 'fisher', 'cats', 'dog', 'cat']:
+		print("can_change_test() passed")
+	else:
+		print("can_change_test() failed")
+		print(expected_outputs)
+		print(outputs)
+		print(exception_outputs)
+
+# Stem a word with all the steps of the algorithm at once. The result is the
+# same as that of passing the word through step1a() up to step5b() in turn,
+# but the pattern of the word is computed only once and kept up to date as
+# suffixes are replaced, so no step has to slice the word to measure it.
+def stem(word):
+	if exceptions:
+		result = exceptions.get(word)
+		if result is not None:
+			return result
+	if instrumentation is not None:
+		return instrumented_stem(word)
+	if not word.endswith(trigger_suffixes) or not can_change(word):
+		return word
+	pattern = CVPattern(word)
+	string = word
+
+	# Step 1a
+	if string[-4:] == 'sses' or string[-3:] == 'ies':
+		string = pattern.replace(len(string) - 2, '')
+	elif string[-1:] == 's' and string[-2:] != 'ss':
+		string = pattern.replace(len(string) - 1, '')
+
+	# Step 1b
+	length = len(string)
+	if string[-3:] == 'eed':
+		if pattern.measure(length - 3) > 0:
+			string = pattern.replace(length - 1, '')
+	elif string[-2:] == 'ed' and pattern.has_vowel(length - 2) or \
+	string[-3:] == 'ing' and pattern.has_vowel(length - 3):
+		end = length - 2 if string[-2:] == 'ed' else length - 3
+		string = pattern.replace(end, '')
+		if string[-2:] in ('at', 'bl', 'iz'):
+			string = pattern.replace(end, 'e')
+		elif pattern.ends_double(end) and string[-1] not in 'lsz':
+			string = pattern.replace(end - 1, '')
+		elif pattern.measure(end) == 1 and \
+		(pattern.ends_cvc(end) or (end == 2 and string[-1] not in 'wxy')):
+			string = pattern.replace(end, 'e')
+
+	# Step 1c
+	if string[-1:] == 'y' and pattern.has_vowel(len(string) - 1):
+		string = pattern.replace(len(string) - 1, 'i')
+
+	# Steps 2, 3 and 4
+	string = step2(string, pattern)
+	string = step3(string, pattern)
+	string = step4(string, pattern)
+
+	# Step 5a
+	length = len(string)
+	if string[-1:] == 'e':
+		m = pattern.measure(length - 1)
+		if m > 1 or (length >= 4 and m == 1 and not pattern.ends_cvc(length - 1)):
+			string = pattern.replace(length - 1, '')
+
+	# Step 5b
+	if string[-2:] == 'll' and pattern.measure(len(string)) > 1:
+		string = string[:-1]
+
+	return string
+
+# Test that stem() gives the same result as applying the steps one by one
+def stem_test():
+	words = ['caresses', 'ponies', 'cats', 'agreed', 'plastered', 'motoring',
+	'conflated', 'hopping', 'filing', 'happy', 'sky', 'relational', 'rational',
+	'vietnamization', 'callousness', 'sensibiliti', 'triplicate', 'goodness',
+	'revival', 'replacement', 'adoption', 'homologous', 'probate', 'rate',
+	'cease', 'controll', 'roll', 'generalizations', 'oscillators', 'fisher',
+	'the', 's', 'y', '']
+	expected_outputs = []
+	for word in words:
+		for step in [step1a, step1b, step1c, step2, step3, step4, step5a, step5b]:
+			word = step(word)
+		expected_outputs.append(word)
+	outputs = list(map(stem, words))
+	if expected_outputs == outputs:
+		print("stem_test() passed")
+	else:
+		print("stem_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# A cache of stems in front of stem(). Since a few words make up most of any
+# text, most lookups are hits that cost a dictionary lookup instead of a run
+# of the algorithm. At most maxsize words are kept, the least recently used
+# one being evicted to make room for a new one, so the cache of a long-running
+# process cannot grow without bound. hits, misses and evictions count what the
+# cache has done since it was created or last cleared, to help choose maxsize.
+class StemCache:
+	def __init__(self, maxsize=65536, stemmer=stem):
+		if maxsize < 1:
+			raise ValueError('maxsize must be at least 1')
+		self.maxsize = maxsize
+		self.stemmer = stemmer
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, word):
+		return word in self.entries
+
+	# Return the stem of word, from the cache if it is there
+	def stem(self, word):
+		entries = self.entries
+		try:
+			result = entries[word]
+		except KeyError:
+			self.misses += 1
+			result = self.stemmer(word)
+			self.add(word, result)
+		else:
+			self.hits += 1
+			entries.move_to_end(word)
+		return result
+
+	__call__ = stem
+
+	# Put the stem of word in the cache, evicting the least recently used
+	# word if the cache is full
+	def add(self, word, result):
+		entries = self.entries
+		entries[word] = result
+		entries.move_to_end(word)
+		if len(entries) > self.maxsize:
+			entries.popitem(last=False)
+			self.evictions += 1
+
+	# Stem the given words ahead of time without counting them as misses
+	def warm(self, words):
+		for word in words:
+			if word not in self.entries:
+				self.add(word, self.stemmer(word))
+
+	# Empty the cache and reset its counters
+	def clear(self):
+		self.entries.clear()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+
+	# Return the counters of the cache along with its size and hit rate
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+			'size': len(self.entries), 'maxsize': self.maxsize,
+			'hit_rate': self.hits / lookups if lookups else 0.0}
+
+def stem_cache_test():
+	cache = StemCache(maxsize=2)
+	outputs = [cache.stem(word) for word in ['cats', 'ponies', 'cats', 'hopping', 'ponies']]
+	expected_outputs = ['cat', 'poni', 'cat', 'hop', 'poni']
+	# 'ponies' was evicted by 'hopping' since 'cats' had been used after it
+	expected_stats = {'hits': 1, 'misses': 4, 'evictions': 2, 'size': 2, 'maxsize': 2,
+		'hit_rate': 0.2}
+	stats = cache.stats()
+	cache.clear()
+	cache.warm(['happy', 'sky'])
+	if expected_outputs == outputs and expected_stats == stats and \
+	list(cache.entries.items()) == [('happy', 'happi'), ('sky', 'sky')] and cache.misses == 0:
+		print("stem_cache_test() passed")
+	else:
+		print("stem_cache_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# The rules of steps 2, 3 and 4 for stem_batch(), with their conditions
+# compiled into functions of a StemBatch, some of its rows and the ends of the
+# stems of those rows
+batch_condition_terms = {'m': '(batch.measure(end, rows) %s %d)', '*v*': 'batch.has_vowel(end, rows)',
+	'*d': 'batch.ends_double(end, rows)', '*o': 'batch.ends_cvc(end, rows)',
+	'*L': '((end > 0) & (batch.char(end - 1, rows) == %(code)d))', 'and': '&', 'or': '|',
+	'not': '~', '(': '(', ')': ')'}
+
+def compile_batch_rules(rules):
+	return tuple((suffix, replacement,
+		eval('lambda batch, rows, end: ' + compile_condition(condition, batch_condition_terms)))
+		for (suffix, replacement, condition) in rules)
+
+batch_steps = ((compile_batch_rules(step2_rules), step2_stops), (compile_batch_rules(step3_rules), ()),
+	(compile_batch_rules(step4_rules), ()))
+
+# Stem a batch of words with NumPy, applying every step to all of the words at
+# once instead of to one word at a time. The words are held as rows of a
+# matrix of character codes, padded with zeros, along with the length of each
+# one. A step finds the rows that end with each of its suffixes and whose
+# conditions hold, and rewrites the ends of all of those rows together. Each
+# distinct word is stemmed only once. The distinct words are put in groups of
+# lengths between a power of two and the next, and each group gets a matrix
+# only as wide as its longest word, so that a few long words do not widen the
+# rows of all of the others. The result is a list of the same stems that
+# stem() would give the words.
+def stem_batch(words):
+	if numpy is None:
+		raise ImportError('stem_batch() requires NumPy')
+	if isinstance(words, numpy.ndarray):
+		words = words.ravel().tolist()
+	# Number the distinct words in the order they first occur
+	numbers = {}
+	inverse = numpy.fromiter((numbers.setdefault(word, len(numbers)) for word in words), dtype=numpy.intp)
+	if len(inverse) == 0:
+		return []
+	distinct = list(numbers)
+	groups = {}
+	for (i, word) in enumerate(distinct):
+		groups.setdefault(len(word).bit_length(), []).append(i)
+	results = numpy.empty(len(distinct), dtype=object)
+	for rows in groups.values():
+		results[rows] = stem_matrix([distinct[i] for i in rows])
+	if exceptions:
+		for (i, word) in enumerate(distinct):
+			if word in exceptions:
+				results[i] = exceptions[word]
+	return results[inverse].tolist()
+
+# Stem distinct words, of about the same length, for stem_batch() and return
+# their stems as a list
+def stem_matrix(words):
+	words = numpy.array(words, dtype=str)
+	width = max(words.dtype.itemsize // 4, 1)
+	chars = numpy.ascontiguousarray(words.astype('U%d' % width)).view(numpy.uint32).reshape(len(words), width)
+	batch = StemBatch(chars.copy(), numpy.char.str_len(words).astype(numpy.intp))
+
+	# Step 1a
+	tail = batch.tail(4)
+	sses_or_ies = batch.ends(tail, 'sses') | batch.ends(tail, 'ies')
+	batch.cut(sses_or_ies, 2)
+	batch.cut(~sses_or_ies & batch.ends(tail, 's') & ~batch.ends(tail, 'ss'), 1)
+
+	# Step 1b
+	lengths = batch.lengths.copy()
+	tail = batch.tail(3)
+	eed = batch.ends(tail, 'eed')
+	ed = ~eed & batch.ends(tail, 'ed') & batch.has_vowel(lengths - 2)
+	ing = ~eed & ~batch.ends(tail, 'ed') & batch.ends(tail, 'ing') & batch.has_vowel(lengths - 3)
+	batch.cut(eed & (batch.measure(lengths - 3) > 0), 1)
+	batch.cut(ed, 2)
+	batch.cut(ing, 3)
+	successful = ed | ing
+	lengths = batch.lengths.copy()
+	tail = batch.tail(2)
+	last = tail[:, -1]
+	add_e = successful & (batch.ends(tail, 'at') | batch.ends(tail, 'bl') | batch.ends(tail, 'iz'))
+	single = successful & ~add_e & batch.ends_double(lengths) & ~batch.char_in(last, 'lsz')
+	add_e |= successful & ~add_e & ~single & (batch.measure(lengths) == 1) & \
+		(batch.ends_cvc(lengths) | ((lengths == 2) & ~batch.char_in(last, 'wxy')))
+	batch.cut(single, 1)
+	batch.replace(add_e, 0, 'e')
+
+	# Step 1c
+	batch.refresh()
+	batch.replace(batch.ends(batch.tail(1), 'y') & batch.has_vowel(batch.lengths - 1), 1, 'i')
+
+	# Steps 2, 3 and 4, only looking at the words whose last letter ends some
+	# suffix of the step
+	for (rules, stops) in batch_steps:
+		batch.refresh()
+		rows = numpy.flatnonzero(batch.char_in(batch.tail(1)[:, 0], {rule[0][-1] for rule in rules}))
+		lengths = batch.lengths[rows]
+		tail = batch.tail(max(len(rule[0]) for rule in rules), rows)
+		pending = numpy.ones(len(rows), dtype=bool)
+		for (suffix, replacement, condition) in rules:
+			matched = pending & batch.ends(tail, suffix)
+			if not matched.any():
+				continue
+			fired = matched & condition(batch, rows, lengths - len(suffix))
+			batch.replace(rows[fired], len(suffix), replacement)
+			pending &= ~fired
+			if suffix in stops:
+				pending &= ~matched
+
+	# Step 5a
+	batch.refresh()
+	lengths = batch.lengths.copy()
+	m = batch.measure(lengths - 1)
+	batch.cut(batch.ends(batch.tail(1), 'e') & \
+		((m > 1) | ((lengths >= 4) & (m == 1) & ~batch.ends_cvc(lengths - 1))), 1)
+
+	# Step 5b
+	batch.refresh()
+	batch.cut(batch.ends(batch.tail(2), 'll') & (batch.measure(batch.lengths) > 1), 1)
+
+	return batch.stems().tolist()
+
+# The rows of character codes and the lengths of the words of stem_batch(),
+# along with their vowel flags, first vowels and prefix measures as in
+# CVPattern. Cutting the ends of words leaves the rest of these as they are,
+# while replace() marks the rows it writes to, whose patterns refresh() then
+# computes again.
+class StemBatch:
+	if numpy is not None:
+		vowel_codes = numpy.array([ord(c) for c in 'aeiou'], dtype=numpy.uint32)
+		# The state of measure() after reading a character, indexed by the
+		# state before it and by 2 * (the character is a vowel) + (it is Y)
+		transitions = numpy.array([[0, 0, 1, 1], [2, 2, 1, 1], [2, 2, 1, 0]], dtype=numpy.int8)
+
+	def __init__(self, chars, lengths):
+		(count, width) = chars.shape
+		self.chars = chars
+		self.lengths = lengths
+		self.rows = numpy.arange(count)
+		self.cv = numpy.zeros((count, width), dtype=bool)
+		self.first_vowel = numpy.zeros(count, dtype=numpy.intp)
+		self.measures = numpy.zeros((count, width + 1), dtype=numpy.int32)
+		self.dirty = numpy.ones(count, dtype=bool)
+		self.refresh()
+
+	# Compute the patterns of the rows written to since the last refresh
+	def refresh(self):
+		rows = self.rows[self.dirty]
+		self.dirty[:] = False
+		if len(rows) == 0:
+			return
+		chars = self.chars[rows]
+		width = chars.shape[1]
+		aeiou = numpy.isin(chars, self.vowel_codes)
+		y = chars == ord('y')
+		cv = aeiou.copy()
+		cv[:, 1:] |= y[:, 1:] & ~aeiou[:, :-1]
+		self.cv[rows] = cv
+		self.first_vowel[rows] = numpy.where(cv.any(axis=1), cv.argmax(axis=1), width)
+		# Run measure() on all of the rows together, a column at a time
+		columns = numpy.ascontiguousarray((2 * cv + y).T.astype(numpy.int8))
+		measures = numpy.zeros((width + 1, len(rows)), dtype=numpy.int32)
+		state = numpy.zeros(len(rows), dtype=numpy.int8)
+		for i in range(width):
+			column = columns[i]
+			measures[i + 1] = measures[i] + ((state == 1) & (column < 2))
+			state = self.transitions[state, column]
+		self.measures[rows] = measures.T
+
+	# The last size character codes of every word, or of the words in rows,
+	# right-aligned, with 0 for positions before the start of a word
+	def tail(self, size, rows=None):
+		rows = self.rows if rows is None else rows
+		positions = self.lengths[rows, None] - size + numpy.arange(size)
+		codes = self.chars[rows[:, None], numpy.clip(positions, 0, None)]
+		codes[positions < 0] = 0
+		return codes
+
+	# The words whose tails end with suffix
+	def ends(self, tail, suffix):
+		codes = numpy.array([ord(c) for c in suffix], dtype=numpy.uint32)
+		return (tail[:, tail.shape[1] - len(suffix):] == codes).all(axis=1)
+
+	def char_in(self, codes, letters):
+		return numpy.isin(codes, [ord(c) for c in letters])
+
+	# The characters at positions of every word, or of the words in rows
+	def char(self, positions, rows=None):
+		rows = self.rows if rows is None else rows
+		return self.chars[rows, numpy.clip(positions, 0, None)]
+
+	# m of the first lengths characters of every word, or of the words in rows
+	def measure(self, lengths, rows=None):
+		rows = self.rows if rows is None else rows
+		return self.measures[rows, numpy.clip(lengths, 0, None)]
+
+	# *v*
+	def has_vowel(self, lengths, rows=None):
+		first_vowel = self.first_vowel if rows is None else self.first_vowel[rows]
+		return first_vowel < lengths
+
+	# *d
+	def ends_double(self, lengths, rows=None):
+		rows = self.rows if rows is None else rows
+		return (lengths >= 2) & (self.char(lengths - 1, rows) == self.char(lengths - 2, rows)) & \
+			~self.cv[rows, numpy.clip(lengths - 1, 0, None)]
+
+	# *o
+	def ends_cvc(self, lengths, rows=None):
+		rows = self.rows if rows is None else rows
+		cv = self.cv
+		return (lengths >= 3) & ~cv[rows, numpy.clip(lengths - 3, 0, None)] & \
+			cv[rows, numpy.clip(lengths - 2, 0, None)] & \
+			~cv[rows, numpy.clip(lengths - 1, 0, None)] & \
+			~self.char_in(self.char(lengths - 1, rows), 'wxy')
+
+	# Remove the last size characters of the selected words
+	def cut(self, selected, size):
+		self.lengths[selected] -= size
+
+	# Replace the last size characters of the selected words with replacement
+	def replace(self, selected, size, replacement):
+		rows = self.rows[selected]
+		if len(rows) == 0:
+			return
+		end = self.lengths[rows] - size
+		for (i, c) in enumerate(replacement):
+			self.chars[rows, end + i] = ord(c)
+		self.lengths[rows] = end + len(replacement)
+		self.dirty[rows] = True
+
+	# The words as an array of strings
+	def stems(self):
+		chars = self.chars
+		chars[numpy.arange(chars.shape[1]) >= self.lengths[:, None]] = 0
+		return chars.view('U%d' % chars.shape[1]).ravel()
+
+def stem_batch_test():
+	if numpy is None:
+		print("stem_batch_test() skipped")
+		return
+	words = ['caresses', 'ponies', 'cats', 'agreed', 'plastered', 'motoring',
+	'conflated', 'hopping', 'filing', 'happy', 'sky', 'relational', 'rational',
+	'vietnamization', 'callousness', 'sensibiliti', 'triplicate', 'goodness',
+	'revival', 'replacement', 'adoption', 'homologous', 'probate', 'rate',
+	'cease', 'controll', 'roll', 'generalizations', 'oscillators', 'acrylics',
+	'ion', 'ions', 'ebing', 'the', 's', 'y', '']
+	expected_outputs = list(map(stem, words))
+	outputs = stem_batch(words)
+	# A long word is stemmed in a group of its own
+	long_word = 'a' * 500 + 'ational'
+	if expected_outputs == outputs and stem_batch([]) == [] and \
+	stem_batch(['cats', long_word, 'cats']) == ['cat', stem(long_word), 'cat']:
+		print("stem_batch_test() passed")
+	else:
+		print("stem_batch_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
 def test_all():
 	step1a_test()
 	step1b_test()
 	step1c_test()
+	rule_candidates_test()
 	step2_test()
 	step3_test()
 	step4_test()
@@ -522,3 +1289,9 @@ def test_all():
 	step5b_test()
 	vowel_test()
 	measure_test()
+	cv_pattern_test()
+	can_change_test()
+	stem_test()
+	stem_cache_test()
+	instrumentation_test()
+	stem_batch_test()
@@ -0,0 +1,202 @@
+# Command-line interface to Porter's algorithm
+# Lines are read from the given files, or from standard input if none are
+# given, in the given encoding with any invalid bytes replaced, and written to
+# standard output as they are stemmed, so that only a bounded number of lines
+# is held in memory however large the input is. The output is one of
+#
+#   text          every line with each of its words replaced by its stem
+#   pairs         a line of WORD<TAB>STEM for every word
+#   frequencies   a line of STEM<TAB>COUNT for every stem once the input
+#                 ends, the most frequent first
+#
+# With one worker, every line read from a pipe or terminal is written as soon
+# as it is stemmed, so that the output of a stream that has not ended, as in
+# tail -f log | porter-stem, keeps up with it. With --workers greater than 1,
+# batches of --batch-lines lines are stemmed in that many processes, each
+# with its own cache, and written in the order they were read.
+#
+# Usage: porter-stem [--mode text|pairs|frequencies] [--workers 1]
+#                    [--cache-size 65536] [--batch-lines 1024] [--stats]
+#                    [FILE ...]
+
+from porter import StemCache
+from porter_corpus import word_pattern, stem_counts
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import io
+import os
+import stat
+import sys
+import time
+
+# Stem the words of lines through cache and return the output for mode, the
+# counts of the words if counting is true and the number of words
+def stem_lines(lines, mode, cache, counting):
+	frequencies = Counter()
+	number_of_tokens = 0
+	if mode == 'text':
+		output = []
+		for line in lines:
+			words = [word.lower() for word in word_pattern.findall(line)]
+			if counting:
+				frequencies.update(words)
+			number_of_tokens += len(words)
+			output.append(word_pattern.sub(lambda match: cache.stem(match.group().lower()), line))
+		return (''.join(output), frequencies, number_of_tokens)
+	words = [word.lower() for line in lines for word in word_pattern.findall(line)]
+	frequencies.update(words)
+	if mode == 'pairs':
+		output = ''.join(word + '\t' + cache.stem(word) + '\n' for word in words)
+	else:
+		output = ''
+	return (output, frequencies, len(words))
+
+def stem_lines_test():
+	from porter import stem
+	lines = ['Carrie Fisher has been Princess Leia,\n', 'the take-charge heroine\n']
+	words = [word.lower() for line in lines for word in word_pattern.findall(line)]
+	expected_outputs = ['carri fisher ha been princess leia,\nthe take-charg heroin\n',
+		''.join(word + '\t' + stem(word) + '\n' for word in words), '']
+	outputs = [stem_lines(lines, mode, StemCache(), True) for mode in ['text', 'pairs', 'frequencies']]
+	if ([output for (output, frequencies, number_of_tokens) in outputs] == expected_outputs
+		and all(frequencies == Counter(words) and number_of_tokens == len(words)
+			for (output, frequencies, number_of_tokens) in outputs)):
+		print("stem_lines_test() passed")
+	else:
+		print("stem_lines_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+worker_cache = None
+
+def start_worker(cache_size):
+	global worker_cache
+	worker_cache = StemCache(cache_size)
+
+# stem_lines() in a worker process, also returning how many lookups of the
+# cache of the worker hit and missed
+def stem_lines_in_worker(lines, mode, counting):
+	(hits, misses) = (worker_cache.hits, worker_cache.misses)
+	(output, frequencies, number_of_tokens) = stem_lines(lines, mode, worker_cache, counting)
+	return (output, frequencies, number_of_tokens, worker_cache.hits - hits,
+		worker_cache.misses - misses)
+
+# Read the lines of files, or of standard input, in encoding
+def read_lines(paths, encoding):
+	for path in paths or ['-']:
+		if path == '-':
+			f = io.TextIOWrapper(sys.stdin.buffer, encoding=encoding, errors='replace')
+		else:
+			f = open(path, 'r', encoding=encoding, errors='replace')
+		try:
+			yield from f
+		finally:
+			if path == '-':
+				if not f.closed:
+					f.detach()
+			else:
+				f.close()
+
+# Group lines into batches of batch_lines
+def batches(lines, batch_lines):
+	batch = []
+	for line in lines:
+		batch.append(line)
+		if len(batch) == batch_lines:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+# Stem the batches in workers processes, keeping at most two batches per
+# worker in flight, and yield the results in the order of the batches
+def stem_batches_in_workers(batches, mode, counting, workers, cache_size):
+	executor = ProcessPoolExecutor(workers, initializer=start_worker, initargs=(cache_size,))
+	pending = deque()
+	try:
+		for batch in batches:
+			pending.append(executor.submit(stem_lines_in_worker, batch, mode, counting))
+			if len(pending) >= 2 * workers:
+				yield pending.popleft().result()
+		while pending:
+			yield pending.popleft().result()
+	finally:
+		executor.shutdown(cancel_futures=True)
+
+def test_all():
+	stem_lines_test()
+
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description='Stem text with Porter\'s algorithm.')
+	parser.add_argument('files', nargs='*', help='files to read (default: standard input)')
+	parser.add_argument('--mode', choices=['text', 'pairs', 'frequencies'], default='text',
+		help='what to write to standard output (default: text)')
+	parser.add_argument('--workers', type=int, default=1, help='number of processes to stem in (default: 1)')
+	parser.add_argument('--cache-size', type=int, default=65536,
+		help='number of stems to cache in each process (default: 65536)')
+	parser.add_argument('--batch-lines', type=int, default=1024,
+		help='number of lines to send to a worker at a time (default: 1024)')
+	parser.add_argument('--encoding', default='utf-8', help='encoding of the files (default: utf-8)')
+	parser.add_argument('--stats', action='store_true',
+		help='report tokens per second, unique types and cache hit rate to standard error')
+	options = parser.parse_args(arguments)
+	if options.workers < 1 or options.batch_lines < 1:
+		parser.error('--workers and --batch-lines must be at least 1')
+
+	start = time.perf_counter()
+	counting = options.stats or options.mode == 'frequencies'
+	cache = StemCache(options.cache_size)
+	lines = read_lines(options.files, options.encoding)
+	# Input that can stall is that of standard input when it is not a file
+	streaming = options.workers == 1 and (not options.files or '-' in options.files) and \
+		not stat.S_ISREG(os.fstat(sys.stdin.fileno()).st_mode)
+	if options.workers == 1:
+		results = (stem_lines([line], options.mode, cache, counting) + (0, 0) for line in lines)
+	else:
+		results = stem_batches_in_workers(batches(lines, options.batch_lines), options.mode,
+			counting, options.workers, options.cache_size)
+
+	frequencies = Counter()
+	number_of_tokens = hits = misses = 0
+	out = sys.stdout
+	try:
+		for (output, batch_frequencies, batch_tokens, batch_hits, batch_misses) in results:
+			if output:
+				out.write(output)
+				if streaming:
+					out.flush()
+			frequencies.update(batch_frequencies)
+			number_of_tokens += batch_tokens
+			hits += batch_hits
+			misses += batch_misses
+		if options.mode == 'frequencies':
+			(frequencies2, mappings) = stem_counts(frequencies, cache.stem)
+			for (result, frequency) in frequencies2.most_common():
+				out.write(result + '\t' + repr(frequency) + '\n')
+		out.flush()
+	except BrokenPipeError:
+		# Stop quietly when the reader of the output goes away, as in
+		# porter-stem big.log | head
+		devnull = os.open(os.devnull, os.O_WRONLY)
+		os.dup2(devnull, sys.stdout.fileno())
+		return 1
+	finally:
+		# Close the input now rather than when the generators are collected,
+		# which may be after standard input has been closed
+		results.close()
+		lines.close()
+
+	if options.stats:
+		seconds = time.perf_counter() - start
+		hits += cache.hits
+		misses += cache.misses
+		print('tokens: %d' % number_of_tokens, file=sys.stderr)
+		print('seconds: %.3f' % seconds, file=sys.stderr)
+		print('tokens/sec: %.0f' % (number_of_tokens / seconds if seconds else 0.0), file=sys.stderr)
+		print('unique types: %d' % len(frequencies), file=sys.stderr)
+		print('cache hit rate: %.3f' % (hits / (hits + misses) if hits + misses else 0.0), file=sys.stderr)
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
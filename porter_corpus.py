@@ -0,0 +1,786 @@
+# Functions for building dictionaries from a corpus without holding the
+# corpus in memory. The corpus is read in chunks and broken into words one
+# word at a time, so that only the dictionaries themselves grow with the
+# size of the corpus.
+
+from porter import stem
+from porter_frequencyfile import save_frequencies, load_frequencies, FrequencyFile
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import heapq
+import itertools
+import json
+import mmap
+import os
+import re
+import tempfile
+
+word_pattern = re.compile('[a-zA-Z]+')
+trailing_word_pattern = re.compile(r'[a-zA-Z]*\Z')
+separator_pattern = re.compile(b'[\x00-\x40\x5b-\x60\x7b-\x7f]')
+
+# Read an open file size characters at a time
+def read_chunks(f, size=1 << 16):
+	return iter(lambda: f.read(size), '')
+
+# Given an iterable of chunks of text, yield the words in the text in
+# lowercase. A word is a maximal run of the letters A to Z, as given by
+# re.split('[^a-zA-Z]', text). The letters at the end of a chunk may be the
+# start of a word that continues in the next chunk, so they are held back
+# and read again with it.
+def tokens(chunks):
+	rest = ''
+	for chunk in chunks:
+		if rest:
+			chunk = rest + chunk
+		end = trailing_word_pattern.search(chunk).start()
+		for match in word_pattern.finditer(chunk, 0, end):
+			yield match.group().lower()
+		rest = chunk[end:]
+	if rest:
+		yield rest.lower()
+
+def tokens_test():
+	text = 'Carrie Fisher has been Princess Leia,\nthe take-charge heroine\n'
+	expected_outputs = [entry.lower() for entry in re.split('[^a-zA-Z]', text) if entry]
+	outputs = [list(tokens([text[i:i + size] for i in range(0, len(text), size)]))
+		for size in [1, 2, 3, 7, len(text)]]
+	if all(output == expected_outputs for output in outputs):
+		print("tokens_test() passed")
+	else:
+		print("tokens_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# Count the given words before and after stemming them with stemmer. Return
+# the counts of the words, the counts of their stems and the stem of every
+# word. The words are counted first, so that each distinct word is stemmed
+# only once however often it occurs. The words are also added to conflations,
+# a ConflationIndex, if one is given.
+def count(words, stemmer=stem, conflations=None):
+	frequencies1 = Counter(words)
+	frequencies2, mappings = stem_counts(frequencies1, stemmer, conflations)
+	return frequencies1, frequencies2, mappings
+
+# Given the counts of some words, stem every word once with stemmer and add
+# its count to that of its stem. Return the counts of the stems and the stem
+# of every word. The stems come in the order in which they would first occur
+# if the words were stemmed one occurrence at a time. In the same pass, the
+# words are added to conflations, a ConflationIndex, if one is given.
+def stem_counts(frequencies1, stemmer=stem, conflations=None):
+	frequencies2 = Counter()
+	mappings = {}
+	for (word, frequency) in frequencies1.items():
+		result = stemmer(word)
+		mappings[word] = result
+		frequencies2[result] += frequency
+		if conflations is not None:
+			conflations.add(word, result, frequency)
+	return frequencies2, mappings
+
+def count_test():
+	words = ['the', 'cats', 'the', 'cat', 's']
+	expected_outputs = (Counter({'the': 2, 'cats': 1, 'cat': 1, 's': 1}),
+		Counter({'the': 2, 'cat': 2, '': 1}),
+		{'the': 'the', 'cats': 'cat', 'cat': 'cat', 's': ''})
+	outputs = count(iter(words))
+	if expected_outputs == outputs and list(outputs[1]) == ['the', 'cat', '']:
+		print("count_test() passed")
+	else:
+		print("count_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# A corpus held as integer IDs instead of strings. Every distinct word is
+# kept once in words, under the ID given by ids, and stemmed once, the ID of
+# its stem in stems being kept in stem_ids. The corpus itself is the array
+# tokens of the IDs of its words, at 4 bytes per word. counts and
+# stem_counts hold the number of occurrences of every word and every stem.
+# IDs are given out in the order in which words and stems first occur.
+class TokenCorpus:
+	def __init__(self, words=(), stemmer=stem):
+		self.stemmer = stemmer
+		self.words = []
+		self.ids = {}
+		self.stems = []
+		self.stem_index = {}
+		self.stem_ids = array('I')
+		self.tokens = array('I')
+		self.counts = array('I')
+		self.stem_counts = array('I')
+		self.add(words)
+
+	# Return the ID of word, giving it one and stemming it if it is new
+	def intern(self, word):
+		i = self.ids.get(word)
+		if i is None:
+			i = len(self.words)
+			self.ids[word] = i
+			self.words.append(word)
+			self.counts.append(0)
+			result = self.stemmer(word)
+			j = self.stem_index.get(result)
+			if j is None:
+				j = len(self.stems)
+				self.stem_index[result] = j
+				self.stems.append(result)
+				self.stem_counts.append(0)
+			self.stem_ids.append(j)
+		return i
+
+	# Append the given words to the corpus
+	def add(self, words):
+		ids = self.ids
+		tokens = self.tokens
+		counts = self.counts
+		stem_counts = self.stem_counts
+		stem_ids = self.stem_ids
+		for word in words:
+			i = ids.get(word)
+			if i is None:
+				i = self.intern(word)
+			tokens.append(i)
+			counts[i] += 1
+			stem_counts[stem_ids[i]] += 1
+
+	def __len__(self):
+		return len(self.tokens)
+
+	# The counts of the words and of the stems, as count() gives them
+	def frequencies(self):
+		return Counter(dict(zip(self.words, self.counts)))
+
+	def stem_frequencies(self):
+		return Counter(dict(zip(self.stems, self.stem_counts)))
+
+	# The stem of every word
+	def mappings(self):
+		stems = self.stems
+		return {word: stems[j] for (word, j) in zip(self.words, self.stem_ids)}
+
+	# The positions in the corpus at which word occurs
+	def positions(self, word):
+		i = self.ids.get(word)
+		return [position for (position, token) in enumerate(self.tokens) if token == i]
+
+	# The positions in the corpus of the words stemmed to result
+	def stem_positions(self, result):
+		j = self.stem_index.get(result)
+		stem_ids = self.stem_ids
+		return [position for (position, token) in enumerate(self.tokens) if stem_ids[token] == j]
+
+def token_corpus_test():
+	words = ['the', 'cats', 'the', 'cat', 's']
+	token_corpus = TokenCorpus(iter(words))
+	outputs = (token_corpus.frequencies(), token_corpus.stem_frequencies(), token_corpus.mappings())
+	expected_outputs = count(iter(words))
+	if expected_outputs == outputs and list(outputs[1]) == list(expected_outputs[1]) and \
+	token_corpus.tokens.tolist() == [0, 1, 0, 2, 3] and token_corpus.stem_ids.tolist() == [0, 1, 1, 2] and \
+	token_corpus.positions('s') == token_corpus.stem_positions('') == [4]:
+		print("token_corpus_test() passed")
+	else:
+		print("token_corpus_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# Statistics of a corpus that grows and shrinks a document at a time: the
+# counts of its words and of their stems, the stem of every word and how many
+# words and stems occur once, twice and so on. Adding or removing a document
+# only updates the entries of the words in it, so it costs time in proportion
+# to the size of the document rather than that of the corpus.
+class CorpusStatistics:
+	def __init__(self, stemmer=stem):
+		self.stemmer = stemmer
+		self.frequencies1 = Counter()
+		self.frequencies2 = Counter()
+		self.mappings = {}
+		self.frequencies_of_frequencies1 = Counter()
+		self.frequencies_of_frequencies2 = Counter()
+
+	# Add change to the count of key in frequencies, moving key from one
+	# frequency to another in frequencies_of_frequencies
+	def shift(self, frequencies, frequencies_of_frequencies, key, change):
+		old = frequencies[key]
+		new = old + change
+		if old > 0:
+			frequencies_of_frequencies[old] -= 1
+			if frequencies_of_frequencies[old] == 0:
+				del frequencies_of_frequencies[old]
+		if new > 0:
+			frequencies[key] = new
+			frequencies_of_frequencies[new] += 1
+		else:
+			del frequencies[key]
+
+	# Add the counts of the words in words, a Counter, to the statistics, or
+	# subtract them if sign is -1
+	def update(self, words, sign):
+		for (word, frequency) in words.items():
+			result = self.mappings.get(word)
+			if result is None:
+				result = self.stemmer(word)
+				self.mappings[word] = result
+			self.shift(self.frequencies1, self.frequencies_of_frequencies1, word, sign * frequency)
+			self.shift(self.frequencies2, self.frequencies_of_frequencies2, result, sign * frequency)
+			if word not in self.frequencies1:
+				del self.mappings[word]
+
+	def add_document(self, text):
+		self.update(Counter(tokens([text])), 1)
+
+	# Remove a document added before. Nothing is changed if the document has
+	# words that the corpus does not have enough of.
+	def remove_document(self, text):
+		words = Counter(tokens([text]))
+		for (word, frequency) in words.items():
+			if self.frequencies1[word] < frequency:
+				raise ValueError('the corpus has %d occurrences of %r, not %d' %
+					(self.frequencies1[word], word, frequency))
+		self.update(words, -1)
+
+	# Save the counts and mappings to a file, from which load() rebuilds the
+	# statistics
+	def save(self, path):
+		f = open(path, 'w')
+		json.dump({'frequencies1': self.frequencies1, 'frequencies2': self.frequencies2,
+			'mappings': self.mappings}, f)
+		f.close()
+
+	@classmethod
+	def load(cls, path, stemmer=stem):
+		f = open(path, 'r')
+		saved = json.load(f)
+		f.close()
+		statistics = cls(stemmer)
+		statistics.frequencies1 = Counter(saved['frequencies1'])
+		statistics.frequencies2 = Counter(saved['frequencies2'])
+		statistics.mappings = saved['mappings']
+		statistics.frequencies_of_frequencies1 = Counter(statistics.frequencies1.values())
+		statistics.frequencies_of_frequencies2 = Counter(statistics.frequencies2.values())
+		return statistics
+
+def corpus_statistics_test():
+	documents = ['Carrie Fisher has been Princess Leia', 'the take-charge heroine of Star Wars',
+		'Princess Leia, the heroine']
+	statistics = CorpusStatistics()
+	for document in documents:
+		statistics.add_document(document)
+	statistics.remove_document(documents[0])
+	try:
+		statistics.remove_document('Carrie Fisher')
+		failed_to_raise = True
+	except ValueError:
+		failed_to_raise = False
+	(handle, path) = tempfile.mkstemp(suffix='.json')
+	os.close(handle)
+	try:
+		statistics.save(path)
+		loaded = CorpusStatistics.load(path)
+	finally:
+		os.remove(path)
+	(frequencies1, frequencies2, mappings) = count(tokens([' '.join(documents[1:])]))
+	expected_outputs = (frequencies1, frequencies2, mappings, Counter(frequencies1.values()),
+		Counter(frequencies2.values()))
+	outputs = [(s.frequencies1, s.frequencies2, s.mappings, s.frequencies_of_frequencies1,
+		s.frequencies_of_frequencies2) for s in [statistics, loaded]]
+	if not failed_to_raise and all(output == expected_outputs for output in outputs):
+		print("corpus_statistics_test() passed")
+	else:
+		print("corpus_statistics_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# Statistics of a table of frequencies gathered in one pass over it. The words
+# are put in buckets by their frequencies, keeping the order they come in, so
+# the number of words with any frequency is the size of its bucket and the k
+# most common words are read from the buckets of the k largest frequencies,
+# found with a heap, in the same order as by Counter.most_common().
+class FrequencyStatistics:
+	def __init__(self, frequencies):
+		buckets = {}
+		tokens = 0
+		for (word, frequency) in frequencies.items():
+			bucket = buckets.get(frequency)
+			if bucket is None:
+				buckets[frequency] = [word]
+			else:
+				bucket.append(word)
+			tokens += frequency
+		self.buckets = buckets
+		self.types = len(frequencies)
+		self.tokens = tokens
+
+	# Return the number of words occurring frequency times
+	def frequency_of_frequency(self, frequency):
+		return len(self.buckets.get(frequency, ()))
+
+	# Return the number of words with every frequency
+	def frequencies_of_frequencies(self):
+		return Counter({frequency: len(words) for (frequency, words) in self.buckets.items()})
+
+	# Return the k most common words with their frequencies, or all of the
+	# words if k is None
+	def most_common(self, k=None):
+		if k is None:
+			frequencies = sorted(self.buckets, reverse=True)
+		else:
+			frequencies = heapq.nlargest(k, self.buckets)
+		result = []
+		for frequency in frequencies:
+			for word in self.buckets[frequency]:
+				if len(result) == k:
+					return result
+				result.append((word, frequency))
+		return result
+
+# The words stemmed to every stem, with their frequencies, for finding the
+# forms of a stem without going over the whole vocabulary. A conflation class
+# is a stem together with the words stemmed to it. The words are numbered in
+# the order they are added, their frequencies being kept in one array, and
+# every class is an array of the numbers of its words. The classes are
+# grouped by size as they grow, so that they can be gone through from the
+# largest without sorting them.
+class ConflationIndex:
+	def __init__(self):
+		self.words = []
+		self.frequencies = array('Q')
+		self.classes = {}
+		self.sizes = {}
+
+	# Build the index of the words counted in frequencies1, given the stem of
+	# every word
+	@classmethod
+	def from_counts(cls, frequencies1, mappings):
+		conflations = cls()
+		for (word, frequency) in frequencies1.items():
+			conflations.add(word, mappings[word], frequency)
+		return conflations
+
+	# Add word, stemmed to result, occurring frequency times. A word must be
+	# added only once.
+	def add(self, word, result, frequency):
+		self.frequencies.append(frequency)
+		self.words.append(word)
+		members = self.classes.get(result)
+		if members is None:
+			members = self.classes[result] = array('I')
+		else:
+			del self.sizes[len(members)][result]
+		members.append(len(self.words) - 1)
+		self.sizes.setdefault(len(members), {})[result] = None
+
+	def __len__(self):
+		return len(self.classes)
+
+	def __contains__(self, result):
+		return result in self.classes
+
+	# Return the number of words stemmed to result
+	def size(self, result):
+		return len(self.classes.get(result, ()))
+
+	# Return the words stemmed to result with their frequencies, in the order
+	# they were added
+	def forms(self, result):
+		words = self.words
+		frequencies = self.frequencies
+		return [(words[i], frequencies[i]) for i in self.classes.get(result, ())]
+
+	# Return the number of occurrences of the words stemmed to result
+	def total(self, result):
+		frequencies = self.frequencies
+		return sum(frequencies[i] for i in self.classes.get(result, ()))
+
+	# Yield the stems with at least minimum words stemmed to them, from those
+	# with the most words to those with the fewest
+	def by_size(self, minimum=1):
+		for size in sorted(self.sizes, reverse=True):
+			if size < minimum:
+				break
+			yield from self.sizes[size]
+
+# A comparison of the frequencies of a corpus before and after stemming,
+# given the stem of every word
+class ConflationStatistics:
+	def __init__(self, frequencies1, frequencies2, mappings):
+		self.raw = FrequencyStatistics(frequencies1)
+		self.stemmed = FrequencyStatistics(frequencies2)
+		self.conflations = ConflationIndex.from_counts(frequencies1, mappings)
+
+	# The fraction of the words that stemming removes from the vocabulary
+	def vocabulary_reduction(self):
+		return 1 - self.stemmed.types / self.raw.types if self.raw.types else 0.0
+
+	# Return the number of words stemmed to result
+	def merged(self, result):
+		return self.conflations.size(result)
+
+	# Return the number of conflation classes of every size
+	def class_sizes(self):
+		return Counter({size: len(classes) for (size, classes) in self.conflations.sizes.items() if classes})
+
+	# Return the k largest conflation classes as (stem, words) pairs
+	def largest_classes(self, k):
+		classes = []
+		for result in self.conflations.by_size():
+			if len(classes) == k:
+				break
+			classes.append((result, [word for (word, frequency) in self.conflations.forms(result)]))
+		return classes
+
+def conflation_index_test():
+	text = 'the relational relate relates related relating the rational the cat cats s'
+	conflations = ConflationIndex()
+	(frequencies1, frequencies2, mappings) = count(tokens([text]), conflations=conflations)
+	outputs = [len(conflations), 'relat' in conflations, 'gener' in conflations,
+		conflations.size('relat'), conflations.forms('cat'), conflations.forms('the'),
+		conflations.forms('gener'), list(conflations.by_size()), list(conflations.by_size(2)),
+		all(conflations.total(result) == frequency for (result, frequency) in frequencies2.items())]
+	expected_outputs = [5, True, False, 5, [('cat', 1), ('cats', 1)], [('the', 3)], [],
+		['relat', 'cat', 'the', 'ration', ''], ['relat', 'cat'], True]
+	if expected_outputs == outputs:
+		print("conflation_index_test() passed")
+	else:
+		print("conflation_index_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+def frequency_statistics_test():
+	text = 'the relational relate relates related relating the rational the cat cats s'
+	(frequencies1, frequencies2, mappings) = count(tokens([text]))
+	statistics = ConflationStatistics(frequencies1, frequencies2, mappings)
+	outputs = [statistics.raw.most_common(3), statistics.stemmed.most_common(2),
+		statistics.raw.most_common(), [statistics.raw.frequency_of_frequency(i) for i in [1, 2, 3, 4]],
+		statistics.stemmed.frequencies_of_frequencies(), statistics.raw.tokens,
+		statistics.vocabulary_reduction(), statistics.merged('relat'), statistics.class_sizes(),
+		statistics.largest_classes(2)]
+	expected_outputs = [frequencies1.most_common(3), frequencies2.most_common(2),
+		frequencies1.most_common(), [9, 0, 1, 0], Counter(frequencies2.values()), 12,
+		1 - 5 / 10, 5, Counter({1: 3, 2: 1, 5: 1}),
+		[('relat', ['relational', 'relate', 'relates', 'related', 'relating']), ('cat', ['cat', 'cats'])]]
+	if expected_outputs == outputs:
+		print("frequency_statistics_test() passed")
+	else:
+		print("frequency_statistics_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# The same tokens as tokens() gives, read from bytes in an ASCII-compatible
+# encoding such as UTF-8 without decoding them. The words are found with a
+# bytes pattern and counted as they are in the bytes, so that only the
+# distinct forms of the words are lowercased, through a translation table,
+# and decoded. Every token still becomes a bytes object, as re has no way to
+# count matches without building them, but no str is made for it.
+byte_word_pattern = re.compile(b'[a-zA-Z]+')
+lowercase_table = bytes.maketrans(b'ABCDEFGHIJKLMNOPQRSTUVWXYZ', b'abcdefghijklmnopqrstuvwxyz')
+
+# Count the words of data, bytes or a memory-mapped file, as count() counts
+# the tokens of its text, down to the order of the entries. data is read
+# window bytes at a time, each window ending before a byte that is not a
+# letter, so that only the tokens of one window are held at once.
+def count_bytes(data, stemmer=stem, window=1 << 20):
+	forms = Counter()
+	size = len(data)
+	start = 0
+	while start < size:
+		end = start + window
+		match = separator_pattern.search(data, end) if end < size else None
+		end = match.start() if match else size
+		forms.update(byte_word_pattern.findall(data, start, end))
+		start = end
+	frequencies1 = Counter()
+	for (form, frequency) in forms.items():
+		frequencies1[form.translate(lowercase_table).decode('ascii')] += frequency
+	frequencies2, mappings = stem_counts(frequencies1, stemmer)
+	return frequencies1, frequencies2, mappings
+
+# Count the words of the file at path with count_bytes(), memory-mapping the
+# file instead of reading it
+def count_file_bytes(path, stemmer=stem, window=1 << 20):
+	with open(path, 'rb') as f:
+		if os.fstat(f.fileno()).st_size == 0:
+			return count_bytes(b'', stemmer)
+		with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+			return count_bytes(data, stemmer, window)
+
+def count_bytes_test():
+	text = 'Carrie Fisher has been Princess Leia,\nthe take-charge heroine \u2013 CARRIE caf\xe9 s'
+	expected_outputs = count(tokens([text]))
+	outputs = [count_bytes(text.encode('utf-8'), window=size) for size in [1, 3, 7, 1 << 20]]
+	(handle, path) = tempfile.mkstemp()
+	os.write(handle, text.encode('utf-8'))
+	os.close(handle)
+	try:
+		outputs.append(count_file_bytes(path, window=5))
+	finally:
+		os.remove(path)
+	if all(output == expected_outputs and list(output[0]) == list(expected_outputs[0])
+		and list(output[1]) == list(expected_outputs[1]) for output in outputs):
+		print("count_bytes_test() passed")
+	else:
+		print("count_bytes_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+# Split the file at path into shards of about shard_size bytes and return
+# the (start, end) byte offsets of each. Every shard but the last ends just
+# before a byte that is neither a letter nor part of a multibyte character,
+# so that no word or character is cut in two.
+def shards(path, shard_size=1 << 22):
+	size = os.path.getsize(path)
+	offsets = []
+	start = 0
+	with open(path, 'rb') as f:
+		while start < size:
+			end = start + shard_size
+			while end < size:
+				f.seek(end)
+				block = f.read(4096)
+				match = separator_pattern.search(block)
+				if match:
+					end += match.start()
+					break
+				end += len(block)
+			end = min(end, size)
+			offsets.append((start, end))
+			start = end
+	return offsets
+
+# Count the words of one shard of a file, as count() would
+def count_shard(path, start, end, encoding='utf-8'):
+	with open(path, 'rb') as f:
+		f.seek(start)
+		text = f.read(end - start).decode(encoding)
+	return count(tokens([text]))
+
+# Count the words of the file at path as count() does, but in shards of
+# about shard_size bytes counted by workers processes at the same time. The
+# counts of the shards are added up in the order of the shards, so the
+# result is the same as that of counting the whole file at once, down to the
+# order of the entries.
+def count_parallel(path, workers=None, shard_size=1 << 22, encoding='utf-8'):
+	offsets = shards(path, shard_size)
+	frequencies1 = Counter()
+	frequencies2 = Counter()
+	mappings = {}
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		results = executor.map(count_shard, [path] * len(offsets),
+			[start for (start, end) in offsets], [end for (start, end) in offsets],
+			[encoding] * len(offsets))
+		for (shard_frequencies1, shard_frequencies2, shard_mappings) in results:
+			frequencies1.update(shard_frequencies1)
+			frequencies2.update(shard_frequencies2)
+			mappings.update(shard_mappings)
+	return frequencies1, frequencies2, mappings
+
+def count_parallel_test():
+	text = 'Carrie Fisher has been Princess Leia, the take\u2013charge heroine of Star Wars\n' * 20
+	with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.txt', delete=False) as f:
+		f.write(text)
+	try:
+		expected_outputs = count(tokens([text]))
+		outputs = [count_parallel(f.name, workers=2, shard_size=size) for size in [1, 10, 1000]]
+	finally:
+		os.remove(f.name)
+	if all(output == expected_outputs and list(output[0]) == list(expected_outputs[0])
+	for output in outputs):
+		print("count_parallel_test() passed")
+	else:
+		print("count_parallel_test() failed")
+
+# Counts of keys kept in memory up to a budget of about budget bytes. When
+# the budget is reached, the counts are written to a temporary file in
+# directory, a run, sorted by key, and memory is cleared for more. merged()
+# then reads the runs at the same time, as a k-way merge, and yields every key
+# once with its total count, in order of the keys, holding only one line of
+# each run in memory. At most fan_in runs are open at once: while there are
+# more, the oldest fan_in are merged into a new run first.
+class SpillingCounter:
+	# The size of the entry of a key in a dict, beyond the key itself, as a
+	# rough estimate
+	entry_size = 100
+	fan_in = 128
+
+	def __init__(self, budget=1 << 26, directory=None):
+		self.budget = budget
+		self.directory = directory
+		self.counts = {}
+		self.size = 0
+		self.runs = []
+
+	def add(self, key, count=1):
+		counts = self.counts
+		if key in counts:
+			counts[key] += count
+		else:
+			counts[key] = count
+			self.size += self.entry_size + len(key)
+			if self.size > self.budget:
+				self.spill()
+
+	def update(self, frequencies):
+		for (key, count) in frequencies.items():
+			self.add(key, count)
+
+	# Write the counts in memory to a new run and clear them
+	def spill(self):
+		counts = self.counts
+		self.write_run((key, counts[key]) for key in sorted(counts))
+		self.counts = {}
+		self.size = 0
+
+	# Write pairs of keys and counts, in order of the keys, to a new run
+	def write_run(self, pairs):
+		(handle, path) = tempfile.mkstemp(prefix='run', suffix='.tsv', dir=self.directory)
+		try:
+			with os.fdopen(handle, 'w', encoding='utf-8') as f:
+				for (key, count) in pairs:
+					f.write('%s\t%d\n' % (key, count))
+		except BaseException:
+			os.remove(path)
+			raise
+		self.runs.append(path)
+
+	# Yield the keys and their counts from a run
+	def read_run(self, path):
+		with open(path, 'r', encoding='utf-8') as f:
+			for line in f:
+				(key, count) = line.rstrip('\n').rsplit('\t', 1)
+				yield key, int(count)
+
+	# Yield every key of the runs at paths with its total count, in order of
+	# the keys
+	def merge_runs(self, paths):
+		current = None
+		total = 0
+		for (key, count) in heapq.merge(*[self.read_run(path) for path in paths]):
+			if key != current:
+				if current is not None:
+					yield current, total
+				current = key
+				total = 0
+			total += count
+		if current is not None:
+			yield current, total
+
+	# Yield every key with its total count, in order of the keys, and remove
+	# the runs once they have all been read. The runs of a merge that fails
+	# are left in runs.
+	def merged(self):
+		if not self.runs:
+			counts = self.counts
+			self.counts = {}
+			self.size = 0
+			for key in sorted(counts):
+				yield key, counts[key]
+			return
+		if self.counts:
+			self.spill()
+		while len(self.runs) > self.fan_in:
+			paths = self.runs[:self.fan_in]
+			self.write_run(self.merge_runs(paths))
+			del self.runs[:self.fan_in]
+			for path in paths:
+				os.remove(path)
+		yield from self.merge_runs(self.runs)
+		for path in self.runs:
+			os.remove(path)
+		self.runs = []
+
+# Count the given words as count() does, but in at most about budget bytes of
+# memory however many distinct words there are, by spilling sorted runs of
+# counts to temporary files in directory and merging them. The results are
+# written as they are merged, sorted, to files at path: the counts of the
+# words and of the stems as saved by save_frequencies() at path + '1' and
+# path + '2', and a line of WORD<TAB>STEM for every word at
+# path + '.mappings'. Each distinct word is stemmed once, as the runs of
+# words are merged, and the stems are counted by spilling runs the same way.
+# The words are still being merged while the stems are counted, so each of
+# the two counts has half of the budget. Words are counted, and written out
+# by save_frequencies(), batch_size at a time, and a batch takes up to a
+# quarter of the budget out of the half of the words, which can shorten it.
+# The budget is an estimate, by which every key held in memory takes
+# entry_size (100) bytes and its length, and every word of a batch
+# entry_size bytes. It leaves out the buffers of the runs being merged, of
+# which there are at most fan_in.
+def count_external(words, path, budget=1 << 26, stemmer=stem, directory=None, batch_size=1 << 16):
+	words = iter(words)
+	entry_size = SpillingCounter.entry_size
+	batch_size = max(1, min(batch_size, budget // 4 // entry_size))
+	counter1 = SpillingCounter(budget // 2 - batch_size * entry_size, directory)
+	while True:
+		batch = Counter(itertools.islice(words, batch_size))
+		if not batch:
+			break
+		counter1.update(batch)
+	counter2 = SpillingCounter(budget - budget // 2, directory)
+
+	def merged_words(f):
+		for (word, frequency) in counter1.merged():
+			result = stemmer(word)
+			f.write(word + '\t' + result + '\n')
+			counter2.add(result, frequency)
+			yield word, frequency
+
+	with open(path + '.mappings', 'w', encoding='utf-8') as f:
+		save_frequencies(path + '1', merged_words(f), batch_size)
+	save_frequencies(path + '2', counter2.merged(), batch_size)
+
+# Read the files written by count_external() at path into memory, as
+# count() returns them
+def load_external(path):
+	mappings = {}
+	with open(path + '.mappings', 'r', encoding='utf-8') as f:
+		for line in f:
+			(word, result) = line.rstrip('\n').split('\t')
+			mappings[word] = result
+	return load_frequencies(path + '1'), load_frequencies(path + '2'), mappings
+
+def count_external_test():
+	text = 'Carrie Fisher has been Princess Leia, the take-charge heroine of Star Wars, ' * 3 + \
+		'the relational relate relates related relating rational cats s'
+	expected_outputs = count(tokens([text]))
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, 'counts')
+	outputs = []
+	runs = []
+	try:
+		# A budget too small for even one word spills a run for every word
+		for budget in [0, 1000, 1 << 26]:
+			count_external(tokens([text]), path, budget, directory=directory, batch_size=5)
+			outputs.append(load_external(path))
+			runs.append(sorted(name for name in os.listdir(directory) if name.startswith('run')))
+		with FrequencyFile(path + '1') as f:
+			words = [word for (word, frequency) in f.items()]
+		# With a run for every word and a fan-in of 3, the runs are merged in
+		# several passes
+		counter = SpillingCounter(0, directory)
+		counter.fan_in = 3
+		counter.update(expected_outputs[0])
+		spilled = len(counter.runs)
+		merged = list(counter.merged())
+		runs.append(sorted(name for name in os.listdir(directory) if name.startswith('run')))
+	finally:
+		for name in os.listdir(directory):
+			os.remove(os.path.join(directory, name))
+		os.rmdir(directory)
+	if all(output == expected_outputs for output in outputs) and runs == [[], [], [], []] and \
+	words == sorted(words) and merged == sorted(expected_outputs[0].items()) and \
+	spilled == len(expected_outputs[0]):
+		print("count_external_test() passed")
+	else:
+		print("count_external_test() failed")
+		print(expected_outputs)
+		print(outputs)
+
+def test_all():
+	tokens_test()
+	count_test()
+	token_corpus_test()
+	corpus_statistics_test()
+	conflation_index_test()
+	frequency_statistics_test()
+	count_bytes_test()
+	count_parallel_test()
+	count_external_test()
@@ -0,0 +1,179 @@
+# Word frequencies saved to disk in a compact binary form, so that the counts
+# of large vocabularies can be passed from one job to another without writing
+# and parsing text. The frequencies saved at a path are kept in three files:
+#
+#   PATH.counts.npy    the counts, as a NumPy array of little-endian 64-bit
+#                      integers
+#   PATH.offsets.npy   n + 1 offsets into PATH.words, one at the start of
+#                      every word and one past the last, as a NumPy array of
+#                      little-endian unsigned 64-bit integers
+#   PATH.words         the words in UTF-8, one after the other
+#
+# Word i is thus PATH.words[offsets[i]:offsets[i + 1]] and occurs counts[i]
+# times. The words are kept in the order they were saved in. The .npy files
+# can be mapped with numpy.load(..., mmap_mode='r') by any program, without
+# this module, while FrequencyFile maps all three files without NumPy.
+
+from collections import Counter
+from array import array
+import mmap
+import os
+import struct
+import sys
+
+npy_magic = b'\x93NUMPY\x01\x00'
+# The header of a .npy file is written with room for the largest shape, so
+# that the shape can be filled in once all of the counts have been written
+npy_header_size = 128
+
+def npy_header(descr, length):
+	header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (descr, length)
+	header = header.ljust(npy_header_size - len(npy_magic) - 2 - 1) + '\n'
+	return npy_magic + struct.pack('<H', len(header)) + header.encode('latin-1')
+
+# Write numbers, an array of 64-bit integers, to f in little-endian order
+def write_numbers(f, numbers):
+	if sys.byteorder != 'little':
+		numbers.byteswap()
+	f.write(numbers.tobytes())
+
+# Save frequencies, a Counter or any iterable of (word, count) pairs, at
+# path. The pairs are written as they come, batch_size at a time, so no copy
+# of the counts is built. The files are written under temporary names which
+# then replace any files already at path.
+def save_frequencies(path, frequencies, batch_size=1 << 16):
+	if isinstance(frequencies, dict):
+		frequencies = frequencies.items()
+	paths = [path + '.counts.npy', path + '.offsets.npy', path + '.words']
+	temporary_paths = [name + '.tmp' for name in paths]
+	(counts_file, offsets_file, words_file) = [open(name, 'wb') for name in temporary_paths]
+	try:
+		counts_file.write(npy_header('<i8', 0))
+		offsets_file.write(npy_header('<u8', 0))
+		length = 0
+		offset = 0
+		counts = array('q')
+		offsets = array('Q', [0])
+		words = []
+		for (word, frequency) in frequencies:
+			word = word.encode('utf-8')
+			offset += len(word)
+			words.append(word)
+			counts.append(frequency)
+			offsets.append(offset)
+			length += 1
+			if len(counts) == batch_size:
+				words_file.write(b''.join(words))
+				write_numbers(counts_file, counts)
+				write_numbers(offsets_file, offsets)
+				words = []
+				counts = array('q')
+				offsets = array('Q')
+		words_file.write(b''.join(words))
+		write_numbers(counts_file, counts)
+		write_numbers(offsets_file, offsets)
+		counts_file.seek(0)
+		counts_file.write(npy_header('<i8', length))
+		offsets_file.seek(0)
+		offsets_file.write(npy_header('<u8', length + 1))
+	finally:
+		for f in [counts_file, offsets_file, words_file]:
+			f.close()
+	for (temporary_path, name) in zip(temporary_paths, paths):
+		os.replace(temporary_path, name)
+
+# Frequencies saved by save_frequencies(), mapped for reading. counts and
+# offsets are read in place where the byte order of the machine allows it and
+# copied out of the files otherwise.
+class FrequencyFile:
+	def __init__(self, path):
+		self.path = path
+		self.maps = []
+		self.counts = self.map_npy(path + '.counts.npy', 'q')
+		self.offsets = self.map_npy(path + '.offsets.npy', 'Q')
+		self.words = self.map(path + '.words')
+		self.size = len(self.counts)
+
+	def map(self, path):
+		with open(path, 'rb') as f:
+			if os.fstat(f.fileno()).st_size == 0:
+				data = b''
+			else:
+				data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				self.maps.append(data)
+		return data
+
+	# Map the array of the .npy file at path, whose items have the given
+	# struct format
+	def map_npy(self, path, format):
+		data = self.map(path)
+		if data[:len(npy_magic)] != npy_magic:
+			self.close()
+			raise ValueError('%s is not a frequency file' % path)
+		start = len(npy_magic) + 2 + struct.unpack_from('<H', data, len(npy_magic))[0]
+		if sys.byteorder == 'little':
+			return memoryview(data)[start:].cast(format)
+		return struct.unpack_from('<%d%s' % ((len(data) - start) // 8, format), data, start)
+
+	def close(self):
+		for numbers in [getattr(self, 'counts', None), getattr(self, 'offsets', None)]:
+			if isinstance(numbers, memoryview):
+				numbers.release()
+		for data in self.maps:
+			data.close()
+		self.maps = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+	def __len__(self):
+		return self.size
+
+	# Return word i
+	def word(self, i):
+		return self.words[self.offsets[i]:self.offsets[i + 1]].decode('utf-8')
+
+	# Yield the words with their counts, in the order they were saved in
+	def items(self):
+		words = self.words
+		offsets = self.offsets
+		counts = self.counts
+		for i in range(self.size):
+			yield words[offsets[i]:offsets[i + 1]].decode('utf-8'), counts[i]
+
+	# Return the frequencies as a Counter
+	def counter(self):
+		return Counter(dict(self.items()))
+
+# Return the frequencies saved at path as a Counter
+def load_frequencies(path):
+	with FrequencyFile(path) as f:
+		return f.counter()
+
+def frequency_file_test():
+	import tempfile
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, 'frequencies')
+	frequencies = Counter({'the': 3, 'caf\xe9': 2, 's': 1, 'relational': 1 << 40})
+	try:
+		save_frequencies(path, frequencies, batch_size=3)
+		with FrequencyFile(path) as f:
+			outputs = [len(f), f.word(1), f.counts[3], list(f.items())]
+		loaded = load_frequencies(path)
+		save_frequencies(path, Counter())
+		empty = load_frequencies(path)
+	finally:
+		for name in os.listdir(directory):
+			os.remove(os.path.join(directory, name))
+		os.rmdir(directory)
+	expected_outputs = [4, 'caf\xe9', 1 << 40, list(frequencies.items())]
+	if expected_outputs == outputs and loaded == frequencies and \
+	list(loaded) == list(frequencies) and empty == Counter():
+		print("frequency_file_test() passed")
+	else:
+		print("frequency_file_test() failed")
+		print(expected_outputs)
+		print(outputs)
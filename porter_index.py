@@ -0,0 +1,282 @@
+# An inverted index of documents by the stems of their words, for finding the
+# documents, such as the lines of a corpus, that contain a term in any of its
+# forms without reading the documents again. Documents are numbered from 0 in
+# the order they are added, and the words of a document from 0 in the order
+# they come in.
+#
+# The postings of a stem are kept as one array of unsigned 32-bit integers.
+# For every document containing the stem, in increasing order, the array holds
+# the difference between the number of the document and that of the previous
+# one (or the number itself for the first), the number of times the stem
+# occurs in the document, and the positions of those occurrences, each as its
+# difference from the previous one (or the position itself for the first).
+#
+# Queries are broken into words and stemmed the same way as the documents.
+# search() reads a query such as
+#
+#   culture "popular music" OR art
+#
+# as the documents containing all of the words and quoted phrases on either
+# side of an OR, and returns the numbers of those documents in order.
+#
+# A saved index starts with the magic bytes PIDX0001, the number of documents
+# and the number n of stems. Then come n + 1 offsets into the stems, n + 1
+# offsets into the postings, the postings of all of the stems one after the
+# other and the stems in UTF-8, sorted. The offsets are counted from the
+# start of the stems and in integers from the start of the postings. All of
+# the numbers are little-endian 32-bit integers.
+
+from porter import StemCache
+from porter_corpus import tokens
+from array import array
+import mmap
+import os
+import re
+import struct
+import sys
+
+magic = b'PIDX0001'
+header_size = len(magic) + 8
+phrase_pattern = re.compile('"([^"]*)"|(\\S+)')
+
+# Yield the documents in postings as (document, positions) pairs, only those
+# in wanted if it is given
+def decode(postings, wanted=None):
+	document = 0
+	i = 0
+	length = len(postings)
+	while i < length:
+		document += postings[i]
+		count = postings[i + 1]
+		if wanted is None or document in wanted:
+			positions = []
+			position = 0
+			for delta in postings[i + 2:i + 2 + count]:
+				position += delta
+				positions.append(position)
+			yield document, positions
+		i += 2 + count
+
+class InvertedIndex:
+	def __init__(self, stemmer=None):
+		self.stemmer = StemCache() if stemmer is None else stemmer
+		self.postings = {}
+		self.last_documents = {}
+		self.document_count = 0
+		self.data = None
+
+	# Build an index of the lines of the file f, each line being a document
+	@classmethod
+	def from_lines(cls, f, stemmer=None):
+		index = cls(stemmer)
+		for line in f:
+			index.add(line)
+		return index
+
+	# Add a document and return its number
+	def add(self, text):
+		document = self.document_count
+		self.document_count += 1
+		stemmer = self.stemmer
+		occurrences = {}
+		for (position, word) in enumerate(tokens([text])):
+			result = stemmer(word)
+			positions = occurrences.get(result)
+			if positions is None:
+				occurrences[result] = [position]
+			else:
+				positions.append(position)
+		all_postings = self.postings
+		last_documents = self.last_documents
+		for (result, positions) in occurrences.items():
+			postings = all_postings.get(result)
+			if postings is None:
+				postings = all_postings[result] = array('I')
+				last = 0
+			else:
+				if not isinstance(postings, array):
+					# Postings read from disk are copied before growing
+					postings = all_postings[result] = array('I', postings)
+				last = last_documents.get(result)
+				if last is None:
+					for (last, _) in decode(postings):
+						pass
+			postings.append(document - last)
+			postings.append(len(positions))
+			previous = 0
+			for position in positions:
+				postings.append(position - previous)
+				previous = position
+			last_documents[result] = document
+		return document
+
+	def __len__(self):
+		return self.document_count
+
+	# Return the stems of the words of text
+	def stems(self, text):
+		return [self.stemmer(word) for word in tokens([text])]
+
+	# Return the numbers of the documents containing result, a stem
+	def documents(self, result):
+		postings = self.postings.get(result, ())
+		documents = []
+		document = 0
+		i = 0
+		length = len(postings)
+		while i < length:
+			document += postings[i]
+			documents.append(document)
+			i += 2 + postings[i + 1]
+		return documents
+
+	# Return the numbers of the documents containing every word of text
+	def all_of(self, text):
+		results = self.stems(text)
+		if not results:
+			return []
+		documents = set(self.documents(results[0]))
+		for result in results[1:]:
+			documents.intersection_update(self.documents(result))
+		return sorted(documents)
+
+	# Return the numbers of the documents containing any word of text
+	def any_of(self, text):
+		documents = set()
+		for result in self.stems(text):
+			documents.update(self.documents(result))
+		return sorted(documents)
+
+	# Return the numbers of the documents containing the words of text one
+	# after the other
+	def phrase(self, text):
+		results = self.stems(text)
+		if not results:
+			return []
+		# Only the positions in the documents containing all of the words are
+		# read
+		candidates = set(self.documents(results[0]))
+		for result in results[1:]:
+			candidates.intersection_update(self.documents(result))
+		matches = None
+		for (offset, result) in enumerate(results):
+			starts = {document: {position - offset for position in positions}
+				for (document, positions) in decode(self.postings.get(result, ()), candidates)}
+			if matches is not None:
+				starts = {document: positions & matches[document]
+					for (document, positions) in starts.items() if document in matches}
+			matches = {document: positions for (document, positions) in starts.items() if positions}
+			if not matches:
+				return []
+			candidates = matches
+		return sorted(matches)
+
+	# Return the numbers of the documents matching query. Terms without any
+	# words, such as punctuation, are left out.
+	def search(self, query):
+		documents = set()
+		for clause in re.split(r'\s+OR\s+', query.strip()):
+			matches = None
+			for match in phrase_pattern.finditer(clause):
+				(quoted, word) = match.groups()
+				if not self.stems(word if quoted is None else quoted):
+					continue
+				if quoted is not None:
+					found = set(self.phrase(quoted))
+				else:
+					found = set(self.all_of(word))
+				matches = found if matches is None else matches & found
+			if matches:
+				documents |= matches
+		return sorted(documents)
+
+	# Save the index to path, replacing any file there once it is written
+	def save(self, path):
+		results = sorted(self.postings)
+		encoded = [result.encode('utf-8') for result in results]
+		stem_offsets = array('I', [0])
+		postings_offsets = array('I', [0])
+		for (result, key) in zip(results, encoded):
+			stem_offsets.append(stem_offsets[-1] + len(key))
+			postings_offsets.append(postings_offsets[-1] + len(self.postings[result]))
+		temporary_path = path + '.tmp'
+		with open(temporary_path, 'wb') as f:
+			f.write(magic)
+			f.write(struct.pack('<II', self.document_count, len(results)))
+			numbers = [stem_offsets, postings_offsets] + [array('I', self.postings[result]) for result in results]
+			for integers in numbers:
+				if sys.byteorder != 'little':
+					integers.byteswap()
+				f.write(integers.tobytes())
+			f.write(b''.join(encoded))
+		os.replace(temporary_path, path)
+
+	# Open an index saved by save(). Its postings are read in place from the
+	# file, which is memory-mapped, where the byte order of the machine allows
+	# it, and copied out of the file otherwise.
+	@classmethod
+	def load(cls, path, stemmer=None):
+		index = cls(stemmer)
+		with open(path, 'rb') as f:
+			data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if data[:len(magic)] != magic:
+			data.close()
+			raise ValueError('%s is not an inverted index' % path)
+		(index.document_count, count) = struct.unpack_from('<II', data, len(magic))
+		offsets = array('I', data[header_size:header_size + 8 * (count + 1)])
+		if sys.byteorder != 'little':
+			offsets.byteswap()
+		stem_offsets = offsets[:count + 1]
+		postings_offsets = offsets[count + 1:]
+		postings_start = header_size + 8 * (count + 1)
+		stems_start = postings_start + 4 * postings_offsets[-1]
+		if sys.byteorder == 'little':
+			numbers = memoryview(data)[postings_start:stems_start].cast('I')
+		else:
+			numbers = array('I', data[postings_start:stems_start])
+			numbers.byteswap()
+		for i in range(count):
+			key = data[stems_start + stem_offsets[i]:stems_start + stem_offsets[i + 1]].decode('utf-8')
+			index.postings[key] = numbers[postings_offsets[i]:postings_offsets[i + 1]]
+		index.data = data
+		return index
+
+	# Release the file of an index opened by load()
+	def close(self):
+		if self.data is not None:
+			self.postings = {result: array('I', postings) for (result, postings) in self.postings.items()}
+			self.data.close()
+			self.data = None
+
+def inverted_index_test():
+	import tempfile
+	documents = ['Carrie Fisher has been Princess Leia', 'the take-charge heroine of Star Wars',
+		'Princess Leia, the heroine', 'heroines of the stars', 'a princess and a heroine']
+	index = InvertedIndex()
+	for document in documents:
+		index.add(document)
+	queries = ['heroines', 'princess heroine', '"princess leia"', '"leia princess"',
+		'star OR fisher', '"the heroine" OR carrie', 'unknown', '', 'heroine ,', '"princess leia" - ""',
+		', OR fisher']
+	outputs = [index.search(query) for query in queries]
+	outputs.append(list(decode(index.postings['heroin'])))
+	(handle, path) = tempfile.mkstemp(suffix='.index')
+	os.close(handle)
+	try:
+		index.save(path)
+		loaded = InvertedIndex.load(path)
+		loaded_outputs = [loaded.search(query) for query in queries]
+		loaded.add('the heroine returns')
+		loaded_outputs.append(loaded.search('"the heroine"'))
+		loaded.close()
+	finally:
+		os.remove(path)
+	expected_outputs = [[1, 2, 3, 4], [2, 4], [0, 2], [], [0, 1, 3], [0, 2], [], [],
+		[1, 2, 3, 4], [0, 2], [0], [(1, [3]), (2, [3]), (3, [0]), (4, [4])]]
+	if expected_outputs == outputs and loaded_outputs == expected_outputs[:-1] + [[2, 5]]:
+		print("inverted_index_test() passed")
+	else:
+		print("inverted_index_test() failed")
+		print(expected_outputs)
+		print(outputs)
+		print(loaded_outputs)
@@ -0,0 +1,252 @@
+# A stemming server for sharing one stemmer and its cache between programs
+# The server listens on a local TCP port or Unix socket and answers one line
+# for every line it is sent:
+#
+#   stem WORD WORD ...   the stems of the words, separated by tabs
+#   text TEXT            the stems of the words of the text, separated by tabs
+#   stats                the metrics of the server as JSON
+#
+# Stems are separated by tabs rather than spaces so that an empty stem, as
+# that of s, keeps its place in the reply. Lines that are not valid UTF-8 are
+# read with the invalid bytes replaced by U+FFFD. A line longer than
+# max_line bytes is skipped and answered with an error line.
+#
+# Requests that arrive within a short window of each other, from any number
+# of connections, are gathered into one batch and stemmed together through a
+# cache shared by all of them, so that each distinct word of a batch is
+# looked up once.
+#
+# Usage: python porter_server.py [--host 127.0.0.1] [--port 8017] [--unix PATH]
+#                                [--cache-size 65536] [--window 0.002]
+#                                [--max-line 1048576]
+
+from porter import StemCache
+from porter_corpus import word_pattern
+from collections import deque
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+class StemServer:
+	def __init__(self, cache_size=65536, window=0.002, max_batch=1024, history=10000,
+		max_line=1 << 20):
+		self.cache = StemCache(cache_size)
+		self.window = window
+		self.max_batch = max_batch
+		self.max_line = max_line
+		self.latencies = deque(maxlen=history)
+		self.queue = None
+		self.server = None
+		self.batcher = None
+		self.requests = 0
+		self.batches = 0
+		self.max_queue_depth = 0
+
+	# Start listening on host and port, or on the Unix socket at path if one
+	# is given. A port of 0 picks a free port, which address() returns.
+	async def start(self, host='127.0.0.1', port=0, path=None):
+		self.queue = asyncio.Queue()
+		self.batcher = asyncio.ensure_future(self.run_batches())
+		if path is None:
+			self.server = await asyncio.start_server(self.handle, host, port, limit=self.max_line)
+		else:
+			self.server = await asyncio.start_unix_server(self.handle, path, limit=self.max_line)
+		return self
+
+	def address(self):
+		return self.server.sockets[0].getsockname()
+
+	async def close(self):
+		self.server.close()
+		await self.server.wait_closed()
+		self.batcher.cancel()
+		try:
+			await self.batcher
+		except asyncio.CancelledError:
+			pass
+
+	async def serve_forever(self):
+		await self.server.serve_forever()
+
+	# Queue words for the next batch and wait for their stems
+	async def stem(self, words):
+		future = asyncio.get_running_loop().create_future()
+		self.queue.put_nowait((words, future, time.perf_counter()))
+		self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+		return await future
+
+	# Take the requests queued within window of the first one, up to
+	# max_batch of them, and stem their distinct words through the cache
+	async def run_batches(self):
+		queue = self.queue
+		while True:
+			batch = [await queue.get()]
+			deadline = time.perf_counter() + self.window
+			while len(batch) < self.max_batch:
+				remaining = deadline - time.perf_counter()
+				if remaining <= 0:
+					break
+				try:
+					batch.append(await asyncio.wait_for(queue.get(), remaining))
+				except asyncio.TimeoutError:
+					break
+			while len(batch) < self.max_batch and not queue.empty():
+				batch.append(queue.get_nowait())
+
+			cache = self.cache
+			results = {}
+			for (words, future, start) in batch:
+				for word in words:
+					if word not in results:
+						results[word] = cache.stem(word)
+			end = time.perf_counter()
+			for (words, future, start) in batch:
+				if not future.done():
+					future.set_result([results[word] for word in words])
+				self.latencies.append(end - start)
+			self.requests += len(batch)
+			self.batches += 1
+
+	# Read a line from reader, returning None for a line longer than the limit
+	# of reader, which is skipped, and an empty string at the end of the stream
+	async def read_line(self, reader):
+		too_long = False
+		while True:
+			try:
+				line = await reader.readuntil(b'\n')
+			except asyncio.IncompleteReadError as error:
+				line = error.partial
+			except asyncio.LimitOverrunError as error:
+				# Drop what has been read of the line and look for its end again
+				await reader.readexactly(error.consumed)
+				too_long = True
+				continue
+			return None if too_long else line
+
+	# Answer the requests of one connection until it is closed
+	async def handle(self, reader, writer):
+		try:
+			while True:
+				line = await self.read_line(reader)
+				if line is None:
+					writer.write(b'error line too long\n')
+					await writer.drain()
+					continue
+				if not line:
+					break
+				(command, _, argument) = line.decode('utf-8', errors='replace').strip().partition(' ')
+				if command == 'stem':
+					reply = '\t'.join(await self.stem(argument.split()))
+				elif command == 'text':
+					words = [word.lower() for word in word_pattern.findall(argument)]
+					reply = '\t'.join(await self.stem(words))
+				elif command == 'stats':
+					reply = json.dumps(self.stats(), sort_keys=True)
+				else:
+					reply = 'error unknown command %r' % command
+				writer.write(reply.encode('utf-8') + b'\n')
+				await writer.drain()
+		except (ConnectionError, asyncio.IncompleteReadError):
+			pass
+		finally:
+			writer.close()
+
+	# Return the 50th, 90th and 99th percentiles of the latencies of the most
+	# recent requests, in seconds
+	def percentiles(self):
+		latencies = sorted(self.latencies)
+		if not latencies:
+			return {'p50': 0.0, 'p90': 0.0, 'p99': 0.0}
+		return dict(('p%d' % p, latencies[min(len(latencies) - 1, len(latencies) * p // 100)])
+			for p in [50, 90, 99])
+
+	def stats(self):
+		return {'requests': self.requests, 'batches': self.batches,
+			'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+			'queue_depth': self.queue.qsize(), 'max_queue_depth': self.max_queue_depth,
+			'latency': self.percentiles(), 'cache': self.cache.stats()}
+
+# Send lines, strings or bytes, to the server at host and port and return its
+# replies, which can be up to limit bytes long
+async def request(host, port, lines, limit=1 << 24):
+	(reader, writer) = await asyncio.open_connection(host, port, limit=limit)
+	replies = []
+	for line in lines:
+		if isinstance(line, str):
+			line = line.encode('utf-8')
+		writer.write(line + b'\n')
+		await writer.drain()
+		replies.append((await reader.readline()).decode('utf-8').rstrip('\n'))
+	writer.close()
+	await writer.wait_closed()
+	return replies
+
+def stem_server_test():
+	from porter import stem
+	texts = ['Carrie Fisher has been Princess Leia', 'the take-charge heroine of Star Wars',
+		'relational conditional generalizations']
+
+	async def run():
+		server = await StemServer().start()
+		small_server = await StemServer(max_line=100).start()
+		(host, port) = server.address()[:2]
+		try:
+			clients = [request(host, port, ['text ' + text, 'stem ' + text.lower()]) for text in texts]
+			replies = await asyncio.gather(*clients)
+			replies.append(await request(host, port, ['stem s cats dogs', b'stem caf\xe9s cats']))
+			# Lines beyond the default limit of 64 KiB of asyncio, and beyond
+			# max_line, which are answered with an error
+			replies.append(await request(host, port, ['text ' + 'cats ' * 20000]))
+			replies.append(await request(*small_server.address()[:2], ['text ' + 'cats ' * 50, 'stem cats']))
+			stats = (await request(host, port, ['stats']))[0]
+		finally:
+			await server.close()
+			await small_server.close()
+		return (replies, json.loads(stats))
+
+	(replies, stats) = asyncio.run(run())
+	expected_replies = [['\t'.join(stem(word.lower()) for word in word_pattern.findall(text)),
+		'\t'.join(stem(word) for word in text.lower().split())] for text in texts]
+	expected_replies.append(['\tcat\tdog', stem('caf\ufffds') + '\tcat'])
+	expected_replies.append(['\t'.join(['cat'] * 20000)])
+	expected_replies.append(['error line too long', 'cat'])
+	if (replies == expected_replies and stats['requests'] == 2 * len(texts) + 3
+		and stats['batches'] <= stats['requests'] and stats['queue_depth'] == 0):
+		print("stem_server_test() passed")
+	else:
+		print("stem_server_test() failed")
+		print(expected_replies)
+		print(replies)
+		print(stats)
+
+def test_all():
+	stem_server_test()
+
+def main(arguments=None):
+	parser = argparse.ArgumentParser(description='Serve Porter\'s algorithm over a local socket.')
+	parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+	parser.add_argument('--port', type=int, default=8017, help='port to listen on (default: 8017)')
+	parser.add_argument('--unix', help='Unix socket to listen on instead of a TCP port')
+	parser.add_argument('--cache-size', type=int, default=65536, help='number of stems to cache (default: 65536)')
+	parser.add_argument('--window', type=float, default=0.002,
+		help='seconds to wait for more requests before stemming a batch (default: 0.002)')
+	parser.add_argument('--max-line', type=int, default=1 << 20,
+		help='longest line to accept, in bytes (default: 1048576)')
+	options = parser.parse_args(arguments)
+
+	async def serve():
+		server = await StemServer(options.cache_size, options.window,
+			max_line=options.max_line).start(options.host, options.port, options.unix)
+		print('Listening on %s' % (options.unix or '%s:%d' % server.address()[:2]), file=sys.stderr)
+		await server.serve_forever()
+
+	try:
+		asyncio.run(serve())
+	except KeyboardInterrupt:
+		pass
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
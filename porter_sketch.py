@@ -0,0 +1,284 @@
+# Approximate counts of the words and stems of a stream of any length in a
+# fixed amount of memory, for when the exact counts of count() would grow
+# without bound. Two sketches are kept for each of words and stems:
+#
+# - A Count-Min sketch estimates the count of any word. It is a table of depth
+#   rows of width counters, a word adding to one counter in every row, chosen
+#   by a hash of the word, and its estimate being the smallest of those
+#   counters. An estimate is never below the true count, and with width
+#   ceil(e / epsilon) and depth ceil(ln(1 / delta)), it is above the true count
+#   by more than epsilon * N, N being the number of words counted, with a
+#   probability of at most delta.
+#
+# - A Space-Saving summary keeps k words with their counts. A word that is
+#   not kept replaces the one with the smallest count c, taking the count
+#   c + 1 and remembering c as its error. The count of a word kept is above
+#   its true count by at most its error, which is at most N / k, and every
+#   word occurring more than N / k times is kept, so the most common words
+#   are found with their counts.
+#
+# The hashes are the same in every process, and sketches with the same
+# parameters can be merged, so the words of a corpus can be counted in shards
+# by different processes and their sketches added up.
+
+from porter import StemCache
+from array import array
+import heapq
+import math
+import zlib
+
+class CountMinSketch:
+	def __init__(self, epsilon=0.001, delta=0.01):
+		self.epsilon = epsilon
+		self.delta = delta
+		self.width = int(math.ceil(math.e / epsilon))
+		self.depth = int(math.ceil(math.log(1 / delta)))
+		self.table = [array('Q', bytes(8 * self.width)) for i in range(self.depth)]
+		self.total = 0
+
+	# The counter of key in every row, from two hashes of it
+	def columns(self, key):
+		data = key.encode('utf-8')
+		first = zlib.crc32(data)
+		second = zlib.adler32(data) | 1
+		width = self.width
+		return [(first + i * second) % width for i in range(self.depth)]
+
+	def add(self, key, count=1):
+		for (row, column) in zip(self.table, self.columns(key)):
+			row[column] += count
+		self.total += count
+
+	def update(self, keys):
+		for key in keys:
+			self.add(key)
+
+	# Return an estimate of the count of key, which is never below it
+	def estimate(self, key):
+		return min(row[column] for (row, column) in zip(self.table, self.columns(key)))
+
+	__getitem__ = estimate
+
+	# Add the counts of other, which must have the same parameters
+	def merge(self, other):
+		if (self.width, self.depth) != (other.width, other.depth):
+			raise ValueError('cannot merge Count-Min sketches of different sizes')
+		for (row, other_row) in zip(self.table, other.table):
+			for column in range(self.width):
+				row[column] += other_row[column]
+		self.total += other.total
+		return self
+
+class SpaceSaving:
+	def __init__(self, k=1000):
+		if k < 1:
+			raise ValueError('k must be at least 1')
+		self.k = k
+		# Every key kept maps to a list of its count and error
+		self.counters = {}
+		# A heap of (count, key) pairs from which the key with the smallest
+		# count is found. Pairs whose counts are out of date are skipped, and
+		# the heap is rebuilt when there are too many of them, so that it
+		# stays within a constant multiple of k.
+		self.heap = []
+		self.total = 0
+
+	def add(self, key, count=1):
+		self.total += count
+		counters = self.counters
+		counter = counters.get(key)
+		if counter is not None:
+			counter[0] += count
+		elif len(counters) < self.k:
+			counter = counters[key] = [count, 0]
+		else:
+			minimum = self.pop_minimum()
+			counter = counters[key] = [minimum + count, minimum]
+		heapq.heappush(self.heap, (counter[0], key))
+		if len(self.heap) > 4 * self.k:
+			self.rebuild()
+
+	def update(self, keys):
+		for key in keys:
+			self.add(key)
+
+	# Remove the key with the smallest count and return its count
+	def pop_minimum(self):
+		heap = self.heap
+		counters = self.counters
+		while True:
+			(count, key) = heapq.heappop(heap)
+			counter = counters.get(key)
+			if counter is not None and counter[0] == count:
+				del counters[key]
+				return count
+
+	def rebuild(self):
+		self.heap = [(counter[0], key) for (key, counter) in self.counters.items()]
+		heapq.heapify(self.heap)
+
+	# The smallest count kept, the most by which the count of a key that is not
+	# kept can have been underestimated
+	def minimum(self):
+		if len(self.counters) < self.k:
+			return 0
+		return min(counter[0] for counter in self.counters.values())
+
+	# Return an estimate of the count of key, which is never below it if key
+	# is kept
+	def estimate(self, key):
+		counter = self.counters.get(key)
+		return counter[0] if counter is not None else self.minimum()
+
+	__getitem__ = estimate
+
+	# Return the n keys with the largest counts, or all of them if n is None,
+	# as (key, count, error) triples. The true count of each key is between
+	# count - error and count.
+	def most_common(self, n=None):
+		items = [(key, count, error) for (key, (count, error)) in self.counters.items()]
+		if n is None:
+			return sorted(items, key=lambda item: item[1], reverse=True)
+		return heapq.nlargest(n, items, key=lambda item: item[1])
+
+	# Add the counts of other, keeping the k largest. A key kept by only one of
+	# the summaries may have been counted up to the smallest count of the
+	# other, which is added to its count and error.
+	def merge(self, other):
+		(minimum, other_minimum) = (self.minimum(), other.minimum())
+		merged = {}
+		for (key, (count, error)) in self.counters.items():
+			merged[key] = [count + other_minimum, error + other_minimum]
+		for (key, (count, error)) in other.counters.items():
+			counter = merged.get(key)
+			if counter is None:
+				merged[key] = [count + minimum, error + minimum]
+			else:
+				counter[0] += count - other_minimum
+				counter[1] += error - other_minimum
+		k = max(self.k, other.k)
+		self.counters = dict(heapq.nlargest(k, merged.items(), key=lambda item: item[1][0]))
+		self.k = k
+		self.total += other.total
+		self.rebuild()
+		return self
+
+# Sketches of the words of a stream and of their stems. Words are stemmed
+# through a StemCache of cache_size words, so that memory stays bounded.
+class SketchCounter:
+	def __init__(self, k=1000, epsilon=0.001, delta=0.01, cache_size=65536):
+		self.raw = (SpaceSaving(k), CountMinSketch(epsilon, delta))
+		self.stemmed = (SpaceSaving(k), CountMinSketch(epsilon, delta))
+		self.cache = StemCache(cache_size)
+
+	def update(self, words):
+		(raw_top, raw_counts) = self.raw
+		(stemmed_top, stemmed_counts) = self.stemmed
+		stem = self.cache.stem
+		for word in words:
+			raw_top.add(word)
+			raw_counts.add(word)
+			result = stem(word)
+			stemmed_top.add(result)
+			stemmed_counts.add(result)
+
+	# The estimated counts of a word and of a stem
+	def word_count(self, word):
+		return self.raw[1].estimate(word)
+
+	def stem_count(self, result):
+		return self.stemmed[1].estimate(result)
+
+	# The n most common words and stems, as (key, count, error) triples
+	def most_common_words(self, n=10):
+		return self.raw[0].most_common(n)
+
+	def most_common_stems(self, n=10):
+		return self.stemmed[0].most_common(n)
+
+	def merge(self, other):
+		for (mine, theirs) in zip(self.raw + self.stemmed, other.raw + other.stemmed):
+			mine.merge(theirs)
+		return self
+
+# Build a stream of size words from a vocabulary of vocabulary_size, the word
+# of rank r occurring with a probability proportional to 1 / r
+def zipf_stream(size, vocabulary_size=5000, seed=2017):
+	import random
+	generator = random.Random(seed)
+	vocabulary = ['w%d' % rank for rank in range(vocabulary_size)]
+	weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+	return generator.choices(vocabulary, weights, k=size)
+
+def count_min_sketch_test():
+	from collections import Counter
+	stream = zipf_stream(100000)
+	exact = Counter(stream)
+	sketches = [CountMinSketch(0.001, 0.01) for i in range(4)]
+	for (i, sketch) in enumerate(sketches):
+		sketch.update(stream[i::4])
+	sketch = sketches[0]
+	for other in sketches[1:]:
+		sketch.merge(other)
+	errors = [sketch.estimate(word) - frequency for (word, frequency) in exact.items()]
+	bound = sketch.epsilon * sketch.total
+	# No estimate is low, and at most a fraction delta of them are off by more
+	# than epsilon * N
+	if sketch.total == len(stream) and min(errors) >= 0 and \
+	sum(error > bound for error in errors) <= sketch.delta * len(errors) and \
+	(sketch.width, sketch.depth) == (2719, 5):
+		print("count_min_sketch_test() passed")
+	else:
+		print("count_min_sketch_test() failed")
+		print(bound, max(errors), min(errors))
+
+def space_saving_test():
+	from collections import Counter
+	stream = zipf_stream(100000)
+	exact = Counter(stream)
+	k = 200
+	summary = SpaceSaving(k)
+	summary.update(stream[:50000])
+	other = SpaceSaving(k)
+	other.update(stream[50000:])
+	summary.merge(other)
+	bound = len(stream) / k
+	top = summary.most_common(10)
+	# Every word occurring more than N / k times is kept, with a count at
+	# most N / k above its true count and an error covering the difference
+	frequent = [word for (word, frequency) in exact.items() if frequency > bound]
+	if [word for (word, count, error) in top] == [word for (word, frequency) in exact.most_common(10)] and \
+	all(word in summary.counters for word in frequent) and \
+	all(count - error <= exact[word] <= count and error <= bound for (word, count, error) in summary.most_common()) and \
+	len(summary.counters) == k and len(summary.heap) <= 4 * k and summary.total == len(stream):
+		print("space_saving_test() passed")
+	else:
+		print("space_saving_test() failed")
+		print(top)
+		print(exact.most_common(10))
+
+def sketch_counter_test():
+	from collections import Counter
+	from porter_corpus import count, tokens
+	text = 'the relational relate relates related relating the rational the cat cats s ' * 20
+	(frequencies1, frequencies2, mappings) = count(tokens([text]))
+	# With room for every word and stem, the counts are exact
+	sketches = SketchCounter(k=20)
+	sketches.update(tokens([text]))
+	other = SketchCounter(k=20)
+	other.update(tokens([text]))
+	sketches.merge(other)
+	if sketches.most_common_words(1) == [('the', 120, 0)] and \
+	sketches.most_common_stems(2) == [('relat', 200, 0), ('the', 120, 0)] and \
+	all(sketches.word_count(word) >= 2 * frequency for (word, frequency) in frequencies1.items()) and \
+	sketches.stem_count('cat') >= 80:
+		print("sketch_counter_test() passed")
+	else:
+		print("sketch_counter_test() failed")
+		print(sketches.most_common_words(3))
+		print(sketches.most_common_stems(3))
+
+def test_all():
+	count_min_sketch_test()
+	space_saving_test()
+	sketch_counter_test()
@@ -0,0 +1,177 @@
+# A table of words and their stems saved to disk, so that the stems worked
+# out by one process can be reused by later ones without running Porter's
+# algorithm again. The table is memory-mapped rather than read, so opening it
+# costs nothing however large it is, only the pages that lookups touch are
+# read, and every process that opens the same table shares them through the
+# page cache.
+#
+# The file starts with the magic bytes PSTB0001, the number n of entries and
+# the number s of slots in its hash index. Then come n + 1 offsets, one at the
+# start of every entry and one past the last, counted from the start of the
+# entries, and the s slots of the index. A word is looked for in the slot
+# given by the CRC-32 of the word modulo s, and then in the following slots,
+# until the slot of its entry or an empty slot is found. A slot holds one plus
+# the number of its entry, or 0 if it is empty. All of these numbers are
+# little-endian 32-bit integers. The entries follow, each being a word and its
+# stem in UTF-8 separated by a NUL byte, sorted by word.
+
+from porter import stem
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+magic = b'PSTB0001'
+header_size = len(magic) + 8
+
+# Save the words of mappings with their stems as a table at path. The table
+# is written to a temporary file which then replaces any table already at
+# path, so processes reading the old table are not disturbed.
+def save_table(path, mappings):
+	entries = sorted((word.encode('utf-8'), result.encode('utf-8'))
+		for (word, result) in mappings.items())
+	offsets = [0]
+	for (word, result) in entries:
+		offsets.append(offsets[-1] + len(word) + 1 + len(result))
+	# At least half of the slots are left empty so that lookups of words that
+	# are not in the table end quickly
+	slot_count = 1
+	while slot_count < 2 * len(entries):
+		slot_count *= 2
+	slots = [0] * slot_count
+	for (i, (word, result)) in enumerate(entries):
+		slot = zlib.crc32(word) % slot_count
+		while slots[slot]:
+			slot = (slot + 1) % slot_count
+		slots[slot] = i + 1
+	temporary_path = path + '.tmp'
+	with open(temporary_path, 'wb') as f:
+		f.write(magic)
+		f.write(struct.pack('<II', len(entries), slot_count))
+		f.write(struct.pack('<%dI' % len(offsets), *offsets))
+		f.write(struct.pack('<%dI' % slot_count, *slots))
+		for (word, result) in entries:
+			f.write(word + b'\0' + result)
+	os.replace(temporary_path, path)
+
+# A table saved by save_table(), opened for lookups. stem() looks a word up
+# in the table and falls back to stemmer when it is not there. If append is
+# true, the stems found that way are kept and added to the table on disk by
+# flush().
+class StemTable:
+	def __init__(self, path, stemmer=stem, append=False):
+		self.path = path
+		self.stemmer = stemmer
+		self.append = append
+		self.added = {}
+		self.open()
+
+	def open(self):
+		with open(self.path, 'rb') as f:
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		if self.data[:len(magic)] != magic:
+			self.data.close()
+			raise ValueError('%s is not a stem table' % self.path)
+		(self.size, self.slot_count) = struct.unpack_from('<II', self.data, len(magic))
+		slots_start = header_size + 4 * (self.size + 1)
+		self.entries_start = slots_start + 4 * self.slot_count
+		# The offsets and slots are read in place where the byte order of the
+		# machine allows it and copied out of the file otherwise
+		if sys.byteorder == 'little':
+			numbers = memoryview(self.data)[header_size:self.entries_start].cast('I')
+		else:
+			numbers = struct.unpack_from('<%dI' % (self.size + 1 + self.slot_count), self.data, header_size)
+		self.offsets = numbers[:self.size + 1]
+		self.slots = numbers[self.size + 1:]
+
+	def close(self):
+		if isinstance(self.offsets, memoryview):
+			self.offsets.release()
+			self.slots.release()
+		self.data.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		self.close()
+
+	def __len__(self):
+		return self.size
+
+	def __contains__(self, word):
+		return self.lookup(word) is not None
+
+	# Return the word and stem of entry i as bytes
+	def entry(self, i):
+		start = self.entries_start + self.offsets[i]
+		end = self.entries_start + self.offsets[i + 1]
+		(word, separator, result) = self.data[start:end].partition(b'\0')
+		return word, result
+
+	# Return the stem of word saved in the table, or None if the table does not
+	# have word
+	def lookup(self, word):
+		key = word.encode('utf-8')
+		slots = self.slots
+		slot_count = self.slot_count
+		slot = zlib.crc32(key) % slot_count
+		while slots[slot]:
+			(entry_word, result) = self.entry(slots[slot] - 1)
+			if entry_word == key:
+				return result.decode('utf-8')
+			slot = (slot + 1) % slot_count
+		return None
+
+	# Return the stem of word from the table, or else from stemmer
+	def stem(self, word):
+		result = self.lookup(word)
+		if result is None:
+			result = self.added.get(word)
+			if result is None:
+				result = self.stemmer(word)
+				if self.append:
+					self.added[word] = result
+		return result
+
+	__call__ = stem
+
+	# Yield the words of the table with their stems, in order of the words
+	def items(self):
+		for i in range(self.size):
+			(word, result) = self.entry(i)
+			yield word.decode('utf-8'), result.decode('utf-8')
+
+	# Write the stems added by stem() to the table on disk and map the new
+	# table in place of the old one
+	def flush(self):
+		if self.added:
+			mappings = dict(self.items())
+			mappings.update(self.added)
+			self.close()
+			save_table(self.path, mappings)
+			self.added = {}
+			self.open()
+
+def stem_table_test():
+	import tempfile
+	(handle, path) = tempfile.mkstemp(suffix='.stems')
+	os.close(handle)
+	try:
+		save_table(path, {'cats': 'cat', 'ponies': 'poni', 'the': 'the', 's': ''})
+		with StemTable(path, append=True) as table:
+			outputs = [len(table), table.lookup('ponies'), table.lookup('s'), table.lookup('hopping'),
+				table.stem('hopping'), len(table)]
+			table.flush()
+			outputs += [len(table), table.lookup('hopping'), list(table.items())]
+	finally:
+		os.remove(path)
+	expected_outputs = [4, 'poni', '', None, 'hop', 4, 5, 'hop',
+		[('cats', 'cat'), ('hopping', 'hop'), ('ponies', 'poni'), ('s', ''), ('the', 'the')]]
+	if expected_outputs == outputs:
+		print("stem_table_test() passed")
+	else:
+		print("stem_table_test() failed")
+		print(expected_outputs)
+		print(outputs)
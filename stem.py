@@ -9,61 +9,51 @@
 # June 2017
 
 from porter import *
-from collections import Counter
-import re
+from porter_corpus import read_chunks, tokens, TokenCorpus, ConflationStatistics
+from porter_frequencyfile import save_frequencies
 
-# Read the culture corpus and build a dictionary from it 
-# without first stemming the entries
+# Read the culture corpus a chunk at a time, keeping its entries as integer
+# IDs. Every distinct entry is stored and stemmed with Porter's algorithm
+# only once.
 f = open('corpus-culture', 'r')
-corpus = f.read()
+entries = TokenCorpus(tokens(read_chunks(f)))
 f.close()
-entries1 = re.split('[^a-zA-Z]', corpus)
-entries1 = list(map(str.lower, entries1)) # Convert all emtroes to lowercase equivalents
-entries1 = list(filter(lambda x: len(x) > 0, entries1)) # Keep only non-empty entries
 
-# Build dictionary of entries with their corresponding frequencies
-entries_with_frequencies1 = Counter()
-for entry in entries1:
-	entries_with_frequencies1[entry] += 1
+# Build two dictionaries from the corpus, one of its entries as they are and
+# one of the entries after they are stemmed
+entries_with_frequencies1 = entries.frequencies()
+entries_with_frequencies2 = entries.stem_frequencies()
 
 d1 = dict(entries_with_frequencies1) # Old dictionary (without stemming)
-
-# Form new dictionary where entries are first stemmed with Porter's algorithm
-entries2 = list(map(step1a, entries1))
-entries2 = list(map(step1b, entries2))
-entries2 = list(map(step1c, entries2))
-entries2 = list(map(step2, entries2))
-entries2 = list(map(step3, entries2))
-entries2 = list(map(step4, entries2))
-entries2 = list(map(step5a, entries2))
-entries2 = list(map(step5b, entries2))
-
-entries_with_frequencies2 = Counter()
-for entry in entries2:
-	entries_with_frequencies2[entry] += 1
-
 d2 = dict(entries_with_frequencies2) # New dictionary (after stemming)
 
 # See what entries were mapped to after stemming
 # To know what a string STRING was stemmed to, type mappings['STRING']
-mappings = dict([(entries1[i], entries2[i]) for i in range(len(entries1))])
+mappings = entries.mappings()
+
+# Gather the statistics of both dictionaries in one pass over each
+statistics = ConflationStatistics(entries_with_frequencies1, entries_with_frequencies2, mappings)
+
+# See what entries were mapped to each stem, with their frequencies
+# To know what entries were stemmed to a string STEM, type conflations.forms('STEM')
+conflations = statistics.conflations
 
 # Print the number of (unique) entries in both dictionaries
 print("Number of entries in both dictionaries")
-print(len(d1))
-print(len(d2))
+print(statistics.raw.types)
+print(statistics.stemmed.types)
 
 # Print the 10 most common entries in each dictionary with
 # their corresponding frequencies
 print("Most frequent entries in both dictionaries")
-print(entries_with_frequencies1.most_common(10))
-print(entries_with_frequencies2.most_common(10))
+print(statistics.raw.most_common(10))
+print(statistics.stemmed.most_common(10))
 
 # Print the number of entries in each dictionary with frequencies 
 # 1, 2, 3, 4, and 5
 for i in [1, 2, 3, 4, 5]:
-	f1 = len([v for v in d1.values() if v == i])
-	f2 = len([v for v in d2.values() if v == i])
+	f1 = statistics.raw.frequency_of_frequency(i)
+	f2 = statistics.stemmed.frequency_of_frequency(i)
 	print("Number of entries with frequency " + repr(i) + ': ' + repr(f1) + '\t' + repr(f2))
 
 # The new dictionary has the empty string occurring a number of times
@@ -72,8 +62,8 @@ for i in [1, 2, 3, 4, 5]:
 # 's' is stemmed to the empty string by step1a of Porter's algorithm. 
 # The line below tests that indeed all the empty strings in the new 
 # dictionary result from the 's'es in the old dictionary or in the corpus
-eses = [index for (index, entry) in enumerate(entries1) if entry == 's']
-empties = [index for (index, entry) in enumerate(entries2) if entry == '']
+eses = entries.positions('s')
+empties = entries.stem_positions('')
 assert(eses == empties)
 
 # Similarly, the line below should also return True since the 
@@ -81,12 +71,8 @@ assert(eses == empties)
 # entry is stemmed to 's', which does not appear to happen
 assert(d1['s'] == d2[''])
 
-# Print the frequencies of the entries in the two 
-# dictionaries to  different files for plotting of charts
-f = open('frequencies1.txt', 'w')
-f.write(repr(list(d1.values())))
-f.close()
-
-f = open('frequencies2.txt', 'w')
-f.write(repr(list(d2.values())))
-f.close()
+# Save the frequencies of the entries in the two dictionaries, along with the
+# entries they belong to, for plotting of charts. See porter_frequencyfile.py for
+# the layout of the files.
+save_frequencies('frequencies1', entries_with_frequencies1)
+save_frequencies('frequencies2', entries_with_frequencies2)